@@ -16,48 +16,246 @@ from zeroconf import Zeroconf, ServiceBrowser, ServiceListener
 import socket
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
+import queue
+import json
 import os
 import base64
+import io
 import mimetypes
+import struct
+import mmap
+import hashlib
+import sqlite3
+import heapq
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 import tiktoken
-from PIL import Image
+from PIL import Image, ImageOps
+
+# orjson serialises the big base64 image strings far faster than the stdlib; optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pybase64 has SIMD encode kernels and the same b64encode signature; the stdlib works too, just slower on big images
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+def _json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# loading o200k_base parses the whole BPE vocabulary, so only ever do it once per encoding
+@lru_cache(maxsize=None)
+def _get_encoding(name):
+    return tiktoken.get_encoding(name)
+
+_TEXT_MIMES = frozenset({
+    'application/json',
+    'application/javascript',
+    'application/x-python',
+    'application/xml',
+    'application/x-sh'
+})
+_TEXT_EXTS = frozenset({'.py', '.js', '.ts', '.java', '.cpp', '.c',
+                        '.h', '.rs', '.go', '.rb', '.php', '.swift',
+                        '.kt', '.scala', '.sh', '.bash', '.md', '.txt',
+                        '.json', '.xml', '.yaml', '.yml', '.toml', '.ini',
+                        '.conf', '.log', '.sql', '.html', '.css', '.scss', '.lua'})
+_IMAGE_MIMES = frozenset({'image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/webp'})
+
+@lru_cache(maxsize=1024)
+def _guess_mime(filepath):
+    mime_type, _ = mimetypes.guess_type(filepath)
+    return mime_type or "application/octet-stream"
+
+# exact token counts survive across sessions here, keyed by a hash of the file content
+TOKEN_CACHE_PATH = os.path.expanduser('~/.cache/saturn/tokens.db')
+
+def _open_token_cache(path=TOKEN_CACHE_PATH):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE IF NOT EXISTS tok(hash BLOB PRIMARY KEY, n INTEGER)")
+        return db
+    except (OSError, sqlite3.Error):
+        # no writable cache dir isn't worth failing an upload over, just count every time
+        return None
+
+# history keeps this placeholder instead of the (multi-MB) data URI; it's swapped back in at send time
+IMAGE_REF_PREFIX = "__REF__"
+
+# keep the last 100 exchanges (user + assistant); the file context is sent separately so it never falls off
+MAX_HISTORY_MESSAGES = 200
+CONTEXT_ACK = {"role": "assistant", "content": "I can see your uploaded files. What would you like to know?"}
+# images are base64'd this many bytes at a time; a multiple of 3 so no chunk gets padded
+B64_READ_CHUNK = 48 * 1024
+# images with a longer edge than this are downscaled before encoding
+MAX_IMAGE_EDGE = 2048
+# how many recently uploaded files (data URIs included) are kept around for unchanged re-uploads
+PATH_CACHE_SIZE = 16
+
+_JPEG_SOF_MARKERS = frozenset((0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF))
+
+def _jpeg_dims(f):
+    # walk the segment headers until a start-of-frame, which carries height then width
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        header = f.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        f.seek(length - 2, 1)
+
+def _image_dims(f):
+    """Read width/height from the header of an open binary file so we don't need PIL just for the size"""
+    f.seek(0)
+    head = f.read(32)
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', head[6:10])
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8X':
+            return 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+        if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', head[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L' and head[20] == 0x2F:
+            bits = int.from_bytes(head[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if head[:2] == b'\xff\xd8':
+        return _jpeg_dims(f)
+    return None
+
+def _b64encode_file(f, prefix=b''):
+    # read an open binary file through an mmap so the raw image never gets copied into a python bytes object first;
+    # joining the encoded chunks measured faster than filling a presized bytearray, same peak memory.
+    # prefix (e.g. the data: header) goes into the same join so the payload is only copied once more, by the decode
+    if os.fstat(f.fileno()).st_size == 0:
+        return prefix.decode('ascii')
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        parts = [prefix]
+        parts.extend(_b64.b64encode(view[start:start + B64_READ_CHUNK])
+                     for start in range(0, len(view), B64_READ_CHUNK))
+        encoded = b''.join(parts)
+    # base64 is pure ascii, which decodes without any codepoint validation
+    return encoded.decode('ascii')
+
+def _load_image(filepath, mime_type):
+    """Return (data_uri, width, height, original_dims); original_dims is set only when the image was downscaled"""
+    # one open serves the header sniff, the PIL fallback/resize and the base64 encode
+    with open(filepath, 'rb') as f:
+        dims = _image_dims(f)
+        if dims is None:
+            # unusual variant the header sniffer doesn't know, let PIL work it out
+            f.seek(0)
+            with Image.open(f) as img:
+                dims = img.size
+        width, height = dims
+        prefix = f'data:{mime_type};base64,'.encode('ascii')
+        
+        if max(width, height) <= MAX_IMAGE_EDGE:
+            # images get base64 encoded for transmission to the ai
+            return _b64encode_file(f, prefix), width, height, None
+        
+        # the model would downscale it anyway, so don't pay to encode and send the full resolution
+        f.seek(0)
+        with Image.open(f) as img:
+            image_format = img.format or 'PNG'
+            # re-saving drops EXIF, so apply its orientation first or phone photos arrive sideways
+            img = ImageOps.exif_transpose(img)
+            original_dims = img.size
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+            buf = io.BytesIO()
+            # default compression settings; optimize=True makes PNG try every zlib strategy, far too slow here
+            img.save(buf, format=image_format)
+            new_width, new_height = img.size
+    encoded = _b64.b64encode(buf.getbuffer())
+    return (prefix + encoded).decode('ascii'), new_width, new_height, original_dims
+
+def _encode_image_file(filepath, mime_type):
+    with open(filepath, 'rb') as f:
+        return _b64encode_file(f, f'data:{mime_type};base64,'.encode('ascii'))
 
 class TokenTracker:
     def __init__(self, warning_cost_cents=25):
         self.warning_cost_cents = warning_cost_cents
-        self.encoding = tiktoken.get_encoding("o200k_base")
-        self.lock = threading.Lock()
+        self.encoding = _get_encoding("o200k_base")
         self.total_input_tokens = 0
         self.total_output_tokens = 0
         self.total_cost = 0.0
         self.warned = False
         
     def estimate_text_tokens(self, text):
-        return len(self.encoding.encode(text))
+        return len(self.encoding.encode_ordinary(text))
+
+    def estimate_text_tokens_batch(self, texts):
+        # tiktoken only fans the BPE work out over its thread pool when it gets a batch
+        if not texts:
+            return []
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)]
+
+    # o200k averages ~3.8 chars/token on ascii (mostly code), close enough for an upload-time figure
+    def estimate_text_tokens_fast(self, text):
+        return -(-len(text) * 10 // 38)
     
     # images are more expensive - calculated based on tile count for high resolution
     def estimate_image_tokens(self, width, height):
-        tiles = ((width + 511) // 512) * ((height + 511) // 512)
+        tiles = ((width + 511) >> 9) * ((height + 511) >> 9)  # 512px tiles, rounded up
         return 85 + 170 * tiles
+
+    def estimate_image_tokens_batch(self, sizes):
+        # same formula over many (width, height) pairs at once, for multi-image uploads
+        return [85 + 170 * (((w + 511) >> 9) * ((h + 511) >> 9)) for w, h in sizes]
     
     def estimate_cost(self, tokens, avg_cost_per_1m=3.0):
         return (tokens / 1_000_000) * avg_cost_per_1m
     
+    # only ever called from the main chat loop once a response is back, so no lock needed
     def update_usage(self, input_tokens, output_tokens):
-        with self.lock:
-            self.total_input_tokens += input_tokens
-            self.total_output_tokens += output_tokens
-            
-            avg_cost = 3.0
-            input_cost = (input_tokens / 1_000_000) * avg_cost
-            output_cost = (output_tokens / 1_000_000) * avg_cost
-            self.total_cost += input_cost + output_cost
-            
-            if self.total_cost >= self.warning_cost_cents / 100 and not self.warned:
-                self.warned = True
-                return True
+        self.total_input_tokens += input_tokens
+        self.total_output_tokens += output_tokens
+        
+        avg_cost = 3.0
+        input_cost = (input_tokens / 1_000_000) * avg_cost
+        output_cost = (output_tokens / 1_000_000) * avg_cost
+        self.total_cost += input_cost + output_cost
+        
+        if self.total_cost >= self.warning_cost_cents / 100 and not self.warned:
+            self.warned = True
+            return True
         return False
     
     def get_summary(self):
@@ -68,39 +266,62 @@ class TokenTracker:
             "cost_cents": self.total_cost * 100
         }
 
+@dataclass(slots=True)
+class FileEntry:
+    type: str
+    content: str
+    mime_type: str
+    tokens: int
+    cost_estimate: float
+    dimensions: tuple = None
+    exact: bool = True
+    sha256: bytes = None
+    pending: Future = None  # background encode filling in content, see finish_uploads()
+
 class FileContextManager:
     def __init__(self, token_tracker):
         self.files = {}
         self.token_tracker = token_tracker
-        
+        # set when a text file only has its chunked estimate; recount_all() fixes them up in one batch
+        self._dirty = False
+        self._token_db = _open_token_cache()
+        # built context message, reused across turns until the file set changes
+        self._ctx_cache = None
+        self._ctx_dirty = True
+        # abspath -> ((mtime_ns, size), FileEntry), least recently used first, so re-uploading an
+        # unchanged file skips the read/encode/count; an edit replaces the path's entry
+        self._path_cache = OrderedDict()
+        # image base64 encoding runs here so /upload returns while the encode overlaps the next prompt
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        # running totals over self.files, kept in step by _add_file/_drop_file/recount_all/clear_all
+        self._total_tokens = 0
+        self._total_cost = 0.0
+
+    def _cached_tokens(self, digest):
+        if self._token_db is None:
+            return None
+        try:
+            row = self._token_db.execute("SELECT n FROM tok WHERE hash = ?", (digest,)).fetchone()
+        except sqlite3.Error:
+            # e.g. another client holding the db locked; just count the tokens ourselves
+            return None
+        return row[0] if row else None
+
     def guess_file_type(self, filepath):
-        mime_type, _ = mimetypes.guess_type(filepath)
+        # known source/text extensions never need the full mimetypes lookup
+        ext = os.path.splitext(filepath)[1].lower()
+        if ext in _TEXT_EXTS:
+            return 'text', mimetypes.types_map.get(ext, 'application/octet-stream')
         
-        if not mime_type:
-            mime_type = "application/octet-stream"
+        mime_type = _guess_mime(filepath)
         
         if mime_type.startswith('text/'):
             return 'text', mime_type
         
-        text_mimes = [
-            'application/json',
-            'application/javascript',
-            'application/x-python',
-            'application/xml',
-            'application/x-sh'
-        ]
-        if mime_type in text_mimes:
-            return 'text', mime_type
-        
-        if any(filepath.endswith(ext) for ext in ['.py', '.js', '.ts', '.java', '.cpp', '.c', 
-                                                    '.h', '.rs', '.go', '.rb', '.php', '.swift',
-                                                    '.kt', '.scala', '.sh', '.bash', '.md', '.txt',
-                                                    '.json', '.xml', '.yaml', '.yml', '.toml', '.ini',
-                                                    '.conf', '.log', '.sql', '.html', '.css', '.scss', '.lua']):
+        if mime_type in _TEXT_MIMES:
             return 'text', mime_type
         
-        image_types = ['image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/webp']
-        if mime_type in image_types:
+        if mime_type in _IMAGE_MIMES:
             return 'image', mime_type
         
         if mime_type == 'application/pdf':
@@ -108,6 +329,50 @@ class FileContextManager:
         
         return 'binary', mime_type
     
+    def _add_file(self, filename, info):
+        self.files[filename] = info
+        self._total_tokens += info.tokens
+        self._total_cost += info.cost_estimate
+        self._ctx_dirty = True
+        return info
+
+    def _drop_file(self, filename):
+        info = self.files.pop(filename)
+        self._total_tokens -= info.tokens
+        self._total_cost -= info.cost_estimate
+        self._ctx_dirty = True
+
+    def _path_key(self, filepath):
+        st = os.stat(filepath)
+        return os.path.abspath(filepath), st.st_mtime_ns, st.st_size
+
+    def _cache_get(self, key):
+        path, stamp = key[0], key[1:]
+        cached = self._path_cache.get(path)
+        if cached is None:
+            return None
+        if cached[0] != stamp:
+            del self._path_cache[path]  # file changed since, that entry can never be used again
+            return None
+        self._path_cache.move_to_end(path)
+        return cached[1]
+
+    def _cache_put(self, key, info):
+        self._path_cache[key[0]] = (key[1:], info)
+        self._path_cache.move_to_end(key[0])
+        while len(self._path_cache) > PATH_CACHE_SIZE:
+            self._path_cache.popitem(last=False)
+        return info
+
+    def _reuse_cached(self, filename, key):
+        info = self._cache_get(key)
+        if info is None:
+            return None
+        self._add_file(filename, info)
+        if not info.exact:
+            self._dirty = True
+        return f"Uploaded {filename} ({info.type}, ~{info.tokens} tokens, ~${info.cost_estimate:.4f}, unchanged since last upload)"
+
     def upload_file(self, filepath):
         if not os.path.exists(filepath):
             return False, f"File not found: {filepath}"
@@ -117,22 +382,45 @@ class FileContextManager:
         if filename in self.files:
             return False, f"File '{filename}' already uploaded. Use /remove first to replace."
         
+        key = self._path_key(filepath)
+        message = self._reuse_cached(filename, key)
+        if message:
+            return True, message
+        
+        success, message = self._load_file(filepath, filename)
+        if success:
+            self._cache_put(key, self.files[filename])
+        return success, message
+
+    def _load_file(self, filepath, filename):
         file_type, mime_type = self.guess_file_type(filepath)
         
         if file_type == 'text':
             try:
                 with open(filepath, 'r', encoding='utf-8') as f:
                     content = f.read()
-                token_count = self.token_tracker.estimate_text_tokens(content)
+                digest = hashlib.sha256(content.encode('utf-8')).digest()
+                token_count = self._cached_tokens(digest)
+                exact = token_count is not None
+                if not exact:
+                    # ascii skips tiktoken until the context is actually sent (recount_all makes it exact)
+                    if content.isascii():
+                        token_count = self.token_tracker.estimate_text_tokens_fast(content)
+                    else:
+                        token_count = self.token_tracker.estimate_text_tokens(content)
                 cost_estimate = self.token_tracker.estimate_cost(token_count)
                 
-                self.files[filename] = {
-                    'type': 'text',
-                    'content': content,
-                    'mime_type': mime_type,
-                    'tokens': token_count,
-                    'cost_estimate': cost_estimate
-                }
+                self._add_file(filename, FileEntry(
+                    type='text',
+                    content=content,
+                    mime_type=mime_type,
+                    tokens=token_count,
+                    cost_estimate=cost_estimate,
+                    exact=exact,
+                    sha256=digest
+                ))
+                if not exact:
+                    self._dirty = True
                 
                 return True, f"Uploaded {filename} (text, ~{token_count} tokens, ~${cost_estimate:.4f})"
             except Exception as e:
@@ -140,31 +428,34 @@ class FileContextManager:
         
         elif file_type == 'image':
             try:
-                with Image.open(filepath) as img:
-                    width, height = img.size
-                
-                # images get base64 encoded for transmission to the ai
                 with open(filepath, 'rb') as f:
-                    encoded = base64.b64encode(f.read()).decode('utf-8')
-                
-                data_uri = f"data:{mime_type};base64,{encoded}"
+                    dims = _image_dims(f)
+                if dims is not None and max(dims) <= MAX_IMAGE_EDGE:
+                    # the header already gave us the size, which is all the estimate needs
+                    width, height = dims
+                    data_uri, original_dims = None, None
+                    pending = self._pool.submit(_encode_image_file, filepath, mime_type)
+                else:
+                    data_uri, width, height, original_dims = _load_image(filepath, mime_type)
+                    pending = None
                 token_count = self.token_tracker.estimate_image_tokens(width, height)
                 cost_estimate = self.token_tracker.estimate_cost(token_count)
                 
-                self.files[filename] = {
-                    'type': 'image',
-                    'content': data_uri,
-                    'mime_type': mime_type,
-                    'tokens': token_count,
-                    'cost_estimate': cost_estimate,
-                    'dimensions': (width, height)
-                }
+                self._add_file(filename, FileEntry(
+                    type='image',
+                    content=data_uri,
+                    mime_type=mime_type,
+                    tokens=token_count,
+                    cost_estimate=cost_estimate,
+                    dimensions=(width, height),
+                    pending=pending
+                ))
                 
-                size_warning = ""
-                if width > 2048 or height > 2048:
-                    size_warning = f" ⚠️  Large image ({width}x{height}), consider resizing"
+                resize_note = ""
+                if original_dims:
+                    resize_note = f" (resized from {original_dims[0]}x{original_dims[1]} to {width}x{height})"
                 
-                return True, f"Uploaded {filename} (image, ~{token_count} tokens, ~${cost_estimate:.4f}){size_warning}"
+                return True, f"Uploaded {filename} (image, ~{token_count} tokens, ~${cost_estimate:.4f}){resize_note}"
             except Exception as e:
                 return False, f"Error reading image file: {e}"
         
@@ -174,15 +465,171 @@ class FileContextManager:
         else:
             return False, f"Unsupported file type: {mime_type}"
     
+    def recount_all(self):
+        # one batched call lets tiktoken spread the BPE work over all cores instead of a call per file
+        pending = [info for info in self.files.values() if info.type == 'text' and not info.exact]
+        if pending:
+            counts = self.token_tracker.estimate_text_tokens_batch([info.content for info in pending])
+            for info, token_count in zip(pending, counts):
+                cost_estimate = self.token_tracker.estimate_cost(token_count)
+                self._total_tokens += token_count - info.tokens
+                self._total_cost += cost_estimate - info.cost_estimate
+                info.tokens = token_count
+                info.cost_estimate = cost_estimate
+                info.exact = True
+            self._store_token_counts(pending)
+        self._dirty = False
+
+    def _store_token_counts(self, entries):
+        if self._token_db is None or not entries:
+            return
+        try:
+            with self._token_db:
+                self._token_db.executemany("INSERT OR REPLACE INTO tok(hash, n) VALUES (?, ?)",
+                                           [(info.sha256, info.tokens) for info in entries])
+        except sqlite3.Error:
+            pass
+
+    def upload_directory(self, dirpath):
+        """Upload every file directly inside dirpath; text and image files are loaded first and token-counted in one batch each"""
+        messages = []
+        texts = []  # (filename, content, mime_type, digest)
+        images = []  # (filename, data_uri, mime_type, (width, height), original_dims)
+        keys = {}  # filename -> path cache key
+        try:
+            with os.scandir(dirpath) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            return [f"Error reading directory {dirpath}: {e}"]
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                if entry.name in self.files:
+                    messages.append(f"File '{entry.name}' already uploaded. Use /remove first to replace.")
+                    continue
+                key = keys[entry.name] = self._path_key(entry.path)
+            except OSError as e:
+                # e.g. deleted or made unreadable since the scandir
+                messages.append(f"Error reading {entry.name}: {e}")
+                continue
+            message = self._reuse_cached(entry.name, key)
+            if message:
+                messages.append(message)
+                continue
+            file_type, mime_type = self.guess_file_type(entry.path)
+            if file_type == 'image':
+                try:
+                    data_uri, width, height, original_dims = _load_image(entry.path, mime_type)
+                except Exception as e:
+                    messages.append(f"Error reading image file {entry.name}: {e}")
+                    continue
+                images.append((entry.name, data_uri, mime_type, (width, height), original_dims))
+                continue
+            if file_type != 'text':
+                messages.append(self._load_file(entry.path, entry.name)[1])
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except Exception as e:
+                messages.append(f"Error reading text file {entry.name}: {e}")
+                continue
+            texts.append((entry.name, content, mime_type, hashlib.sha256(content.encode('utf-8')).digest()))
+
+        cached = [self._cached_tokens(digest) for _, _, _, digest in texts]
+        counted = iter(self.token_tracker.estimate_text_tokens_batch(
+            [content for (_, content, _, _), n in zip(texts, cached) if n is None]))
+        new_entries = []
+        for (filename, content, mime_type, digest), token_count in zip(texts, cached):
+            if token_count is None:
+                token_count = next(counted)
+                fresh = True
+            else:
+                fresh = False
+            cost_estimate = self.token_tracker.estimate_cost(token_count)
+            entry = self._cache_put(keys[filename], self._add_file(filename, FileEntry(
+                type='text',
+                content=content,
+                mime_type=mime_type,
+                tokens=token_count,
+                cost_estimate=cost_estimate,
+                sha256=digest
+            )))
+            if fresh:
+                new_entries.append(entry)
+            messages.append(f"Uploaded {filename} (text, ~{token_count} tokens, ~${cost_estimate:.4f})")
+        self._store_token_counts(new_entries)
+
+        image_tokens = self.token_tracker.estimate_image_tokens_batch([dims for _, _, _, dims, _ in images])
+        for (filename, data_uri, mime_type, dims, original_dims), token_count in zip(images, image_tokens):
+            cost_estimate = self.token_tracker.estimate_cost(token_count)
+            self._cache_put(keys[filename], self._add_file(filename, FileEntry(
+                type='image',
+                content=data_uri,
+                mime_type=mime_type,
+                tokens=token_count,
+                cost_estimate=cost_estimate,
+                dimensions=dims
+            )))
+            resize_note = ""
+            if original_dims:
+                resize_note = f" (resized from {original_dims[0]}x{original_dims[1]} to {dims[0]}x{dims[1]})"
+            messages.append(f"Uploaded {filename} (image, ~{token_count} tokens, ~${cost_estimate:.4f}){resize_note}")
+
+        if not messages:
+            messages.append(f"No files found in {dirpath}")
+        return messages
+
+    def finish_uploads(self):
+        """Wait for background image encodes; returns error messages for any that failed (those files are dropped)"""
+        errors = []
+        for filename, info in list(self.files.items()):
+            if info.pending is None:
+                continue
+            try:
+                info.content = info.pending.result()
+                info.pending = None
+            except Exception as e:
+                self._drop_file(filename)
+                for path in [path for path, (_, cached) in self._path_cache.items() if cached is info]:
+                    del self._path_cache[path]
+                errors.append(f"Error reading image file {filename}: {e}")
+        return errors
+
+    def resolve_image_refs(self, messages):
+        """Copy of messages with image placeholders replaced by their data URIs (history itself is left alone)"""
+        resolved = []
+        for message in messages:
+            content = message['content']
+            if isinstance(content, list):
+                blocks = []
+                for block in content:
+                    url = block.get('image_url', {}).get('url', '')
+                    if url.startswith(IMAGE_REF_PREFIX):
+                        info = self.files.get(url[len(IMAGE_REF_PREFIX):])
+                        if info is None:
+                            continue  # image was removed since the context was injected
+                        block = {"type": "image_url", "image_url": {"url": info.content}}
+                    blocks.append(block)
+                message = {**message, 'content': blocks}
+            resolved.append(message)
+        return resolved
+
     def remove_file(self, filename):
         if filename in self.files:
-            del self.files[filename]
+            self._drop_file(filename)
             return True, f"Removed {filename}"
         return False, f"File not found: {filename}"
     
     def clear_all(self):
         count = len(self.files)
         self.files.clear()
+        # /clear-files is the way to free memory, so don't keep the data URIs alive for re-uploads
+        self._path_cache.clear()
+        self._total_tokens = 0
+        self._total_cost = 0.0
+        self._ctx_dirty = True
         return f"Cleared {count} file(s)"
     
     def list_files(self):
@@ -190,48 +637,55 @@ class FileContextManager:
             return "No files uploaded"
         
         lines = [f"Context files ({len(self.files)} total):"]
-        total_tokens = 0
-        total_cost = 0
         
         for i, (filename, info) in enumerate(self.files.items(), 1):
-            total_tokens += info['tokens']
-            total_cost += info['cost_estimate']
+            tokens = info.tokens
+            file_type = info.type
             
-            if info['type'] == 'text':
-                lines.append(f"  {i}. {filename} (text, ~{info['tokens']} tokens)")
-            elif info['type'] == 'image':
-                w, h = info['dimensions']
-                lines.append(f"  {i}. {filename} (image, {w}x{h}, ~{info['tokens']} tokens)")
+            if file_type == 'text':
+                lines.append(f"  {i}. {filename} (text, ~{tokens} tokens)")
+            elif file_type == 'image':
+                w, h = info.dimensions
+                lines.append(f"  {i}. {filename} (image, {w}x{h}, ~{tokens} tokens)")
         
-        lines.append(f"\nTotal: ~{total_tokens} tokens, ~${total_cost:.4f}")
+        lines.append(f"\nTotal: ~{self._total_tokens} tokens, ~${self._total_cost:.4f}")
         return "\n".join(lines)
     
     # this builds a special first message that gets injected into the conversation with all file context
     def build_context_message(self):
+        if not self._ctx_dirty:
+            return self._ctx_cache
+        self._ctx_cache = self._build_context_message()
+        self._ctx_dirty = False
+        return self._ctx_cache
+
+    def _build_context_message(self):
         if not self.files:
             return None
+        if self._dirty:
+            self.recount_all()
         
-        content_blocks = []
-        
-        text_files = []
-        for filename, info in self.files.items():
-            if info['type'] == 'text':
-                text_files.append(f"# {filename}\n{info['content']}")
-        
-        if text_files:
-            combined_text = "\n\n---\n\n".join(text_files)
-            content_blocks.append({
-                "type": "text",
-                "text": f"Here are the uploaded files for context:\n\n{combined_text}"
-            })
-        
+        # write the text files straight into one buffer instead of building per-file strings and joining them
+        text = io.StringIO()
+        image_blocks = []
         for filename, info in self.files.items():
-            if info['type'] == 'image':
-                content_blocks.append({
+            if info.type == 'text':
+                text.write("\n\n---\n\n" if text.tell() else "Here are the uploaded files for context:\n\n")
+                text.write("# ")
+                text.write(filename)
+                text.write("\n")
+                text.write(info.content)
+            elif info.type == 'image':
+                image_blocks.append({
                     "type": "image_url",
-                    "image_url": {"url": info['content']}
+                    "image_url": {"url": IMAGE_REF_PREFIX + filename}
                 })
         
+        content_blocks = []
+        if text.tell():
+            content_blocks.append({"type": "text", "text": text.getvalue()})
+        content_blocks.extend(image_blocks)
+        
         if content_blocks:
             return {"role": "user", "content": content_blocks}
         return None
@@ -240,8 +694,46 @@ class SimpleListener(ServiceListener):
     def __init__(self, on_service_change=None):
         self.services = {}  # name -> (url, priority)
         self.lock = threading.Lock()
-        self.service_found = threading.Event()
+        # holds the latest best (name, url); the wait for the first service and the handoff of its url in one
+        self.found = queue.Queue(maxsize=1)
         self.on_service_change = on_service_change  # Callback for service changes
+        # (priority, seq, name) min-heap; entries for removed/re-prioritised services are skipped lazily
+        self._heap = []
+        self._seq = itertools.count()
+        self._sorted = None  # cached get_all_services() result, reset on any change
+        # (name, url) of the current best service, recomputed only when the service set changes
+        self.best = (None, None)
+
+    def _push(self, name, priority):
+        # seq keeps ties in discovery order, same as min() over the dict did
+        heapq.heappush(self._heap, (priority, next(self._seq), name))
+        # flapping services leave stale entries behind; rebuild before they pile up
+        if len(self._heap) > 2 * len(self.services) + 16:
+            self._heap = [(info['priority'], next(self._seq), n) for n, info in self.services.items()]
+            heapq.heapify(self._heap)
+        self._sorted = None
+
+    def _refresh_best(self):
+        # caller holds the lock; pops stale heap entries until a live one is on top
+        heap = self._heap
+        while heap:
+            priority, _, name = heap[0]
+            info = self.services.get(name)
+            if info is not None and info['priority'] == priority:
+                self.best = (name, info['url'])
+                return
+            heapq.heappop(heap)
+        self.best = (None, None)
+
+    def _offer_best(self):
+        # caller holds the lock; swap out whatever best nobody has picked up yet
+        if self.best[1] is None:
+            return
+        try:
+            self.found.get_nowait()
+        except queue.Empty:
+            pass
+        self.found.put_nowait(self.best)
 
     # listening for zeroconf services and storing all of them
     def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
@@ -249,21 +741,33 @@ class SimpleListener(ServiceListener):
         if not info:
             return
 
-        with self.lock:
-            address = socket.inet_ntoa(info.addresses[0])
-            port = info.port
-            url = f"http://{address}:{port}"
-            priority = info.priority if info.priority else 50
-            # Clean up the service name (remove .local. suffix if present)
-            clean_name = name.replace('._saturn._tcp.local.', '')
+        address = socket.inet_ntoa(info.addresses[0])
+        port = info.port
+        url = f"http://{address}:{port}"
+        priority = info.priority if info.priority else 50
+        # Clean up the service name (remove .local. suffix if present)
+        clean_name = name.replace('._saturn._tcp.local.', '')
 
-            is_new = clean_name not in self.services
-            self.services[clean_name] = {'url': url, 'priority': priority}
-            self.service_found.set()
+        with self.lock:
+            existing = self.services.get(clean_name)
+            if existing is None:
+                self.services[clean_name] = {'url': url, 'priority': priority}
+                self._push(clean_name, priority)
+                previous_best = self.best
+                self._refresh_best()
+                if self.best != previous_best:
+                    self._offer_best()
 
-            # Notify about new service
-            if is_new and self.on_service_change:
-                self.on_service_change('added', clean_name, url, priority)
+                # Notify about new service
+                if self.on_service_change:
+                    self.on_service_change('added', clean_name, url, priority)
+            elif existing['url'] != url or existing['priority'] != priority:
+                # record actually changed, patch the entry we already have
+                existing['url'] = url
+                if existing['priority'] != priority:
+                    existing['priority'] = priority
+                    self._push(clean_name, priority)
+                self._refresh_best()
 
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         """Called when a service disappears from the network"""
@@ -273,6 +777,8 @@ class SimpleListener(ServiceListener):
             if clean_name in self.services:
                 service_info = self.services[clean_name]
                 del self.services[clean_name]
+                self._sorted = None
+                self._refresh_best()
 
                 # Notify about removed service
                 if self.on_service_change:
@@ -280,26 +786,26 @@ class SimpleListener(ServiceListener):
 
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         """Called when a service's information changes"""
-        # Treat updates as a re-add
+        # Treat updates as a re-add; add_service leaves unchanged entries alone
         self.add_service(zc, type_, name)
 
     def get_best_service(self):
         """Get the service with the lowest priority (highest preference)"""
-        with self.lock:
-            if not self.services:
-                return None, None
-            best = min(self.services.items(), key=lambda x: x[1]['priority'])
-            return best[0], best[1]['url']
+        # kept up to date by add/remove, so the per-prompt check needs neither the lock nor a scan
+        return self.best
 
     def get_all_services(self):
         """Get all discovered services sorted by priority"""
         with self.lock:
-            return sorted(self.services.items(), key=lambda x: x[1]['priority'])
+            if self._sorted is None:
+                self._sorted = sorted(self.services.items(), key=lambda x: x[1]['priority'])
+            return self._sorted
 
 def main():
-    # Track notifications to show to user
-    service_notifications = []
+    # Track notifications to show to user (capped so a flapping network can't pile them up)
+    service_notifications = deque(maxlen=32)
     notification_lock = threading.Lock()
+    notifications_ready = threading.Event()
 
     def handle_service_change(action, name, url, priority):
         """Callback when services are added/removed"""
@@ -308,6 +814,16 @@ def main():
                 service_notifications.append(f"\n  ⚠️  New server discovered: {name} at {url} (priority: {priority})")
             elif action == 'removed':
                 service_notifications.append(f"\n  ⚠️  Server removed: {name} (was at {url})")
+        notifications_ready.set()
+
+    # one pooled session for the whole chat so every request reuses the kept-alive connection
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount("http://", adapter)
+
+    # the BPE vocabulary takes a few hundred ms to load; do it while discovery is waiting on the network
+    tokenizer_warmup = threading.Thread(target=_get_encoding, args=("o200k_base",), daemon=True)
+    tokenizer_warmup.start()
 
     zc = Zeroconf()
     listener = SimpleListener(on_service_change=handle_service_change)
@@ -315,13 +831,22 @@ def main():
     browser = ServiceBrowser(zc, "_saturn._tcp.local.", listener)
 
     print("Searching for Saturn services...")
-    time.sleep(1.5)
-    if not listener.service_found.wait(timeout=3.0):
+    settle_until = time.monotonic() + 1.5
+    try:
+        _, first_url = listener.found.get(timeout=4.5)
+    except queue.Empty:
         print("No Saturn services found.")
         browser.cancel()
         zc.close()
         return
 
+    # while other servers get a moment to answer, already fetch models from (and warm the
+    # connection to) the first one; it's usually the one we end up using
+    prefetch = ThreadPoolExecutor(max_workers=1)
+    early_models = prefetch.submit(session.get, f"{first_url}/v1/models", timeout=5)
+    prefetch.shutdown(wait=False)
+    time.sleep(max(0.0, settle_until - time.monotonic()))
+
     # Get the best service (highest priority)
     current_server_name, current_service_url = listener.get_best_service()
     if not current_service_url:
@@ -335,9 +860,12 @@ def main():
 
     # Fetch available models from the server
     try:
-        models_response = requests.get(f"{current_service_url}/v1/models", timeout=5)
+        if current_service_url == first_url:
+            models_response = early_models.result()
+        else:
+            models_response = session.get(f"{current_service_url}/v1/models", timeout=5)
         if models_response.ok:
-            available_models = [model['id'] for model in models_response.json().get('models', [])]
+            available_models = [model['id'] for model in _json_loads(models_response.content).get('models', [])]
             if available_models:
                 current_model = available_models[0]
                 print(f"Using model: {current_model}")
@@ -357,17 +885,17 @@ def main():
         zc.close()
         return
 
+    tokenizer_warmup.join()
     token_tracker = TokenTracker(warning_cost_cents=25)
     file_manager = FileContextManager(token_tracker)
 
-    chat_history = []
-    context_injected = False
+    chat_history = deque(maxlen=MAX_HISTORY_MESSAGES)
 
     print("\n" + "="*60)
     print("Enhanced Saturn Chat Client")
     print("="*60)
     print("\nCommands:")
-    print("  /upload <filepath>  - Upload a file for context")
+    print("  /upload <path>     - Upload a file (or every file in a directory) for context")
     print("  /list              - List uploaded files")
     print("  /remove <filename> - Remove a specific file")
     print("  /clear-files       - Remove all files")
@@ -380,249 +908,252 @@ def main():
     print("  quit               - Exit")
     print("="*60 + "\n")
 
-    while True:
-        # Display any service change notifications
-        with notification_lock:
-            if service_notifications:
-                for notification in service_notifications:
-                    print(notification)
-                service_notifications.clear()
-                print()  # Extra newline for readability
-
-        # Check if current server is still available
-        current_server_name, current_service_url = listener.get_best_service()
-        if not current_service_url:
-            print("\n  ⚠️  All servers offline! Waiting for services...")
-            time.sleep(2)
-            continue
+    try:
+        while True:
+            # Display any service change notifications (only take the lock when something arrived)
+            if notifications_ready.is_set():
+                with notification_lock:
+                    notifications_ready.clear()
+                    if service_notifications:
+                        for notification in service_notifications:
+                            print(notification)
+                        service_notifications.clear()
+                        print()  # Extra newline for readability
 
-        user_input = input("You: ").strip()
+            # Check if current server is still available
+            current_server_name, current_service_url = listener.get_best_service()
+            if not current_service_url:
+                print("\n  ⚠️  All servers offline! Waiting for services...")
+                time.sleep(2)
+                continue
 
-        if not user_input:
-            continue
+            user_input = input("You: ").strip()
+
+            if not user_input:
+                continue
             
-        if user_input.lower() == "quit":
-            break
-        
-        if user_input.startswith("/upload "):
-            filepath = user_input[8:].strip()
-            success, message = file_manager.upload_file(filepath)
-            print(message)
-            context_injected = False
-            continue
+            if user_input.lower() == "quit":
+                break
         
-        elif user_input == "/list":
-            print(file_manager.list_files())
-            continue
+            if user_input.startswith("/upload "):
+                filepath = user_input[8:].strip()
+                if os.path.isdir(filepath):
+                    for message in file_manager.upload_directory(filepath):
+                        print(message)
+                else:
+                    success, message = file_manager.upload_file(filepath)
+                    print(message)
+                continue
         
-        elif user_input.startswith("/remove "):
-            filename = user_input[8:].strip()
-            success, message = file_manager.remove_file(filename)
-            print(message)
-            if success:
-                context_injected = False
-            continue
+            elif user_input == "/list":
+                print(file_manager.list_files())
+                continue
         
-        elif user_input == "/clear-files":
-            message = file_manager.clear_all()
-            print(message)
-            context_injected = False
-            continue
+            elif user_input.startswith("/remove "):
+                filename = user_input[8:].strip()
+                success, message = file_manager.remove_file(filename)
+                print(message)
+                continue
         
-        elif user_input == "/clear":
-            chat_history = []
-            context_injected = False
-            print("Chat history cleared.")
-            continue
+            elif user_input == "/clear-files":
+                message = file_manager.clear_all()
+                print(message)
+                continue
         
-        elif user_input == "/info":
-            summary = token_tracker.get_summary()
-            print(f"\nToken Usage:")
-            print(f"  Input tokens:  {summary['input_tokens']}")
-            print(f"  Output tokens: {summary['output_tokens']}")
-            print(f"  Total cost:    ${summary['cost_usd']:.4f} ({summary['cost_cents']:.2f}¢)")
-            print(f"  Warning at:    ${token_tracker.warning_cost_cents/100:.2f}")
-            continue
-
-        elif user_input == "/servers":
-            all_services = listener.get_all_services()
-            if not all_services:
-                print("No servers discovered")
-            else:
-                print(f"\nAvailable servers (current: {current_server_name}):")
-                for name, info in all_services:
-                    marker = " <- current" if name == current_server_name else ""
-                    print(f"  - {name} (priority: {info['priority']}, url: {info['url']}){marker}")
-            continue
+            elif user_input == "/clear":
+                chat_history.clear()
+                print("Chat history cleared.")
+                continue
+        
+            elif user_input == "/info":
+                summary = token_tracker.get_summary()
+                print(f"\nToken Usage:")
+                print(f"  Input tokens:  {summary['input_tokens']}")
+                print(f"  Output tokens: {summary['output_tokens']}")
+                print(f"  Total cost:    ${summary['cost_usd']:.4f} ({summary['cost_cents']:.2f}¢)")
+                print(f"  Warning at:    ${token_tracker.warning_cost_cents/100:.2f}")
+                continue
 
-        elif user_input == "/change-server":
-            all_services = listener.get_all_services()
-            if len(all_services) <= 1:
-                print("Only one server available")
+            elif user_input == "/servers":
+                all_services = listener.get_all_services()
+                if not all_services:
+                    print("No servers discovered")
+                else:
+                    print(f"\nAvailable servers (current: {current_server_name}):")
+                    for name, info in all_services:
+                        marker = " <- current" if name == current_server_name else ""
+                        print(f"  - {name} (priority: {info['priority']}, url: {info['url']}){marker}")
                 continue
 
-            print("\nAvailable servers:")
-            for i, (name, info) in enumerate(all_services, 1):
-                marker = " <- current" if name == current_server_name else ""
-                print(f"  {i}. {name} (priority: {info['priority']}){marker}")
+            elif user_input == "/change-server":
+                all_services = listener.get_all_services()
+                if len(all_services) <= 1:
+                    print("Only one server available")
+                    continue
 
-            try:
-                choice = input("\nEnter server name or number: ").strip()
+                print("\nAvailable servers:")
+                for i, (name, info) in enumerate(all_services, 1):
+                    marker = " <- current" if name == current_server_name else ""
+                    print(f"  {i}. {name} (priority: {info['priority']}){marker}")
 
-                # Try to parse as number first
                 try:
-                    idx = int(choice) - 1
-                    if 0 <= idx < len(all_services):
-                        new_server_name, new_server_info = all_services[idx]
-                    else:
-                        print("Invalid number")
-                        continue
-                except ValueError:
-                    # Not a number, treat as name
-                    matching = [s for s in all_services if s[0] == choice]
-                    if matching:
-                        new_server_name, new_server_info = matching[0]
-                    else:
-                        print(f"Server '{choice}' not found")
-                        continue
+                    choice = input("\nEnter server name or number: ").strip()
 
-                # Switch to new server
-                current_server_name = new_server_name
-                current_service_url = new_server_info['url']
+                    # Try to parse as number first
+                    try:
+                        idx = int(choice) - 1
+                        if 0 <= idx < len(all_services):
+                            new_server_name, new_server_info = all_services[idx]
+                        else:
+                            print("Invalid number")
+                            continue
+                    except ValueError:
+                        # Not a number, treat as name
+                        matching = [s for s in all_services if s[0] == choice]
+                        if matching:
+                            new_server_name, new_server_info = matching[0]
+                        else:
+                            print(f"Server '{choice}' not found")
+                            continue
+
+                    # Switch to new server
+                    current_server_name = new_server_name
+                    current_service_url = new_server_info['url']
+
+                    # Fetch models from new server
+                    try:
+                        models_response = session.get(f"{current_service_url}/v1/models", timeout=5)
+                        if models_response.ok:
+                            available_models = [model['id'] for model in _json_loads(models_response.content).get('models', [])]
+                            if available_models:
+                                current_model = available_models[0]
+                                print(f"Switched to server: {current_server_name}")
+                                print(f"Using model: {current_model}")
+                                # Clear chat history when switching servers
+                                chat_history.clear()
+                            else:
+                                print("No models available from this server")
+                        else:
+                            print(f"Failed to fetch models from server")
+                    except Exception as e:
+                        print(f"Error fetching models: {e}")
+                except KeyboardInterrupt:
+                    print("\nCancelled")
+                continue
 
-                # Fetch models from new server
+            elif user_input == "/models":
                 try:
-                    models_response = requests.get(f"{current_service_url}/v1/models", timeout=5)
+                    models_response = session.get(f"{current_service_url}/v1/models", timeout=5)
                     if models_response.ok:
-                        available_models = [model['id'] for model in models_response.json().get('models', [])]
+                        available_models = [model['id'] for model in _json_loads(models_response.content).get('models', [])]
                         if available_models:
-                            current_model = available_models[0]
-                            print(f"Switched to server: {current_server_name}")
-                            print(f"Using model: {current_model}")
-                            # Clear chat history when switching servers
-                            chat_history = []
-                            context_injected = False
+                            print(f"\nAvailable models on {current_server_name} (current: {current_model}):")
+                            for i, model in enumerate(available_models, 1):
+                                marker = " <- current" if model == current_model else ""
+                                print(f"  {i}. {model}{marker}")
                         else:
-                            print("No models available from this server")
+                            print("No models available")
                     else:
-                        print(f"Failed to fetch models from server")
+                        print("Failed to fetch models")
                 except Exception as e:
-                    print(f"Error fetching models: {e}")
-            except KeyboardInterrupt:
-                print("\nCancelled")
-            continue
+                    print(f"Error: {e}")
+                continue
 
-        elif user_input == "/models":
-            try:
-                models_response = requests.get(f"{current_service_url}/v1/models", timeout=5)
-                if models_response.ok:
-                    available_models = [model['id'] for model in models_response.json().get('models', [])]
-                    if available_models:
-                        print(f"\nAvailable models on {current_server_name} (current: {current_model}):")
+            elif user_input == "/change-model":
+                try:
+                    models_response = session.get(f"{current_service_url}/v1/models", timeout=5)
+                    if models_response.ok:
+                        available_models = [model['id'] for model in _json_loads(models_response.content).get('models', [])]
+                        if not available_models:
+                            print("No models available")
+                            continue
+
+                        print("\nAvailable models:")
                         for i, model in enumerate(available_models, 1):
                             marker = " <- current" if model == current_model else ""
                             print(f"  {i}. {model}{marker}")
-                    else:
-                        print("No models available")
-                else:
-                    print("Failed to fetch models")
-            except Exception as e:
-                print(f"Error: {e}")
-            continue
-
-        elif user_input == "/change-model":
-            try:
-                models_response = requests.get(f"{current_service_url}/v1/models", timeout=5)
-                if models_response.ok:
-                    available_models = [model['id'] for model in models_response.json().get('models', [])]
-                    if not available_models:
-                        print("No models available")
-                        continue
-
-                    print("\nAvailable models:")
-                    for i, model in enumerate(available_models, 1):
-                        marker = " <- current" if model == current_model else ""
-                        print(f"  {i}. {model}{marker}")
 
-                    choice = input("\nEnter model name or number: ").strip()
+                        choice = input("\nEnter model name or number: ").strip()
 
-                    # Try to parse as number first
-                    try:
-                        idx = int(choice) - 1
-                        if 0 <= idx < len(available_models):
-                            current_model = available_models[idx]
-                            print(f"Switched to model: {current_model}")
-                        else:
-                            print("Invalid number")
-                    except ValueError:
-                        # Not a number, treat as model name
-                        if choice in available_models:
-                            current_model = choice
-                            print(f"Switched to model: {current_model}")
-                        else:
-                            print(f"Model '{choice}' not found")
-                else:
-                    print("Failed to fetch models")
-            except KeyboardInterrupt:
-                print("\nCancelled")
-            except Exception as e:
-                print(f"Error: {e}")
-            continue
+                        # Try to parse as number first
+                        try:
+                            idx = int(choice) - 1
+                            if 0 <= idx < len(available_models):
+                                current_model = available_models[idx]
+                                print(f"Switched to model: {current_model}")
+                            else:
+                                print("Invalid number")
+                        except ValueError:
+                            # Not a number, treat as model name
+                            if choice in available_models:
+                                current_model = choice
+                                print(f"Switched to model: {current_model}")
+                            else:
+                                print(f"Model '{choice}' not found")
+                    else:
+                        print("Failed to fetch models")
+                except KeyboardInterrupt:
+                    print("\nCancelled")
+                except Exception as e:
+                    print(f"Error: {e}")
+                continue
 
-        elif user_input.startswith("/"):
-            print(f"Unknown command: {user_input}")
-            continue
-        
-        # if files are uploaded, we inject them as context at the start of the conversation once
-        context_msg = file_manager.build_context_message()
-        if context_msg and not context_injected:
-            chat_history.insert(0, context_msg)
-            chat_history.insert(1, {"role": "assistant", "content": "I can see your uploaded files. What would you like to know?"})
-            context_injected = True
+            elif user_input.startswith("/"):
+                print(f"Unknown command: {user_input}")
+                continue
         
-        current_message = chat_history + [{"role": "user", "content": user_input}]
+            for message in file_manager.finish_uploads():
+                print(message)
+            
+            # if files are uploaded, their context always leads the conversation (the message is cached until files change)
+            context_msg = file_manager.build_context_message()
+            current_message = [context_msg, CONTEXT_ACK] if context_msg else []
+            current_message.extend(chat_history)
+            current_message.append({"role": "user", "content": user_input})
 
-        payload = {
-            "model": current_model,
-            "messages": current_message
-        }
+            payload = {
+                "model": current_model,
+                "messages": file_manager.resolve_image_refs(current_message)
+            }
 
-        try:
-            # sending the actual chat request to whichever service we're connected to
-            response = requests.post(
-                f"{current_service_url}/v1/chat/completions", 
-                json=payload,
-                timeout=120
-            )
+            try:
+                # sending the actual chat request to whichever service we're connected to
+                response = session.post(
+                    f"{current_service_url}/v1/chat/completions", 
+                    data=_json_dumps(payload),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=120
+                )
             
-            if response.ok:
-                data = response.json()
-                assistant_message = data['choices'][0]['message']['content']
-                print(f"AI: {assistant_message}")
+                if response.ok:
+                    data = _json_loads(response.content)
+                    assistant_message = data['choices'][0]['message']['content']
+                    print(f"AI: {assistant_message}")
                 
-                usage = data.get('usage', {})
-                if usage:
-                    input_tokens = usage.get('prompt_tokens', 0)
-                    output_tokens = usage.get('completion_tokens', 0)
+                    usage = data.get('usage', {})
+                    if usage:
+                        input_tokens = usage.get('prompt_tokens', 0)
+                        output_tokens = usage.get('completion_tokens', 0)
                     
-                    if token_tracker.update_usage(input_tokens, output_tokens):
-                        print(f"\n  WARNING: Cost exceeded ${token_tracker.warning_cost_cents/100:.2f}!")
-                        summary = token_tracker.get_summary()
-                        print(f"Current cost: ${summary['cost_usd']:.4f}")
-                        print("Continuing anyway... (use /info to check usage)\n")
+                        if token_tracker.update_usage(input_tokens, output_tokens):
+                            print(f"\n  WARNING: Cost exceeded ${token_tracker.warning_cost_cents/100:.2f}!")
+                            summary = token_tracker.get_summary()
+                            print(f"Current cost: ${summary['cost_usd']:.4f}")
+                            print("Continuing anyway... (use /info to check usage)\n")
                 
-                chat_history.append({"role": "user", "content": user_input})
-                chat_history.append({"role": "assistant", "content": assistant_message})
-            else:
-                print(f"Error: {response.status_code} - {response.text}")
+                    chat_history.append({"role": "user", "content": user_input})
+                    chat_history.append({"role": "assistant", "content": assistant_message})
+                else:
+                    print(f"Error: {response.status_code} - {response.text}")
         
-        except requests.exceptions.Timeout:
-            print("Request timed out. Try again.")
-        except Exception as e:
-            print(f"Error: {e}")
-    
-    browser.cancel()
-    zc.close()
+            except requests.exceptions.Timeout:
+                print("Request timed out. Try again.")
+            except Exception as e:
+                print(f"Error: {e}")
+    finally:
+        browser.cancel()
+        zc.close()
+        session.close()
     
     summary = token_tracker.get_summary()
     print(f"\nSession complete!")
@@ -1,20 +1,28 @@
 import argparse
+import asyncio
+import importlib.util
 import socket
 import subprocess
 import threading
 import time
 import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Literal
 import uvicorn
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import json
+import queue
 
 
 #used for when i was debugging, there are so many logs now that I am just keeping them. they are going to be commented out for now.
@@ -25,6 +33,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# how long a resolved .local hostname is reused before asking the resolver again
+DNS_CACHE_TTL = 60.0
+# keep-alive pool sizes for the health probes and the forwarded chat requests
+HTTP_POOL_CONNECTIONS = 32
+HTTP_POOL_MAXSIZE = 64
+# upper bound on concurrent health probes per monitor round
+HEALTH_CHECK_WORKERS = 16
+# a probe result is trusted this long; older ones get re-probed right before a request is routed there
+HEALTH_TTL = 30.0
+# unhealthy services are re-probed this often (the old polling interval) so a recovered one comes back quickly
+UNHEALTHY_RECHECK_INTERVAL = 20
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+    session.mount("http://", adapter)
+    return session
+
 @dataclass
 class AIService:
     name: str
@@ -33,8 +59,11 @@ class AIService:
     priority: int
     last_seen: datetime = field(default_factory=datetime.now)
     is_healthy: bool = False
-    available_models: List[str] = field(default_factory=list)
+    available_models: Tuple[str, ...] = ()
     first_check_complete: bool = False
+    health_checked_at: float = 0.0  # time.monotonic() of the last probe
+    # held while probing, so request threads that find the same stale service share one probe
+    probe_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
 
     @property
     def url(self) -> str:
@@ -46,6 +75,13 @@ class ServiceDiscovery:
         self.lock = threading.Lock()
         self.running = True
         self.discovery_interval = discovery_interval
+        # hostname -> (resolved_at, ip); only touched from the discovery thread
+        self._resolved: Dict[str, Tuple[float, str]] = {}
+        # bumped whenever a service appears, moves, disappears or changes health/models,
+        # so the router knows when its model index is stale
+        self.version = 0
+        # services that are new or moved, for the health monitor to probe right away
+        self.changed: "queue.Queue[Optional[AIService]]" = queue.Queue()
         self.thread = threading.Thread(target=self._discovery_loop, daemon=True)
         self.thread.start()
 
@@ -127,28 +163,32 @@ class ServiceDiscovery:
                                 priority = int(priority_str)
 
                     if hostname and port:
-                        try:
-                            ip_address = socket.gethostbyname(hostname)
-                        except socket.gaierror:
-                            ip_address = hostname
+                        ip_address = self._resolve(hostname)
 
                         discovered_services.add(service_name)
 
                         with self.lock:
                             if service_name not in self.services:
-                                self.services[service_name] = AIService(
+                                service = self.services[service_name] = AIService(
                                     name=service_name,
                                     address=ip_address,
                                     port=port,
                                     priority=priority
                                 )
                                 logger.info(f"Discovered service: {service_name} at {ip_address}:{port} (priority: {priority})")
+                                self.version += 1
+                                self.changed.put(service)
                             else:
                                 # Update existing service
                                 service = self.services[service_name]
-                                service.address = ip_address
-                                service.port = port
-                                service.priority = priority
+                                if (service.address, service.port, service.priority) != (ip_address, port, priority):
+                                    moved = (service.address, service.port) != (ip_address, port)
+                                    service.address = ip_address
+                                    service.port = port
+                                    service.priority = priority
+                                    self.version += 1
+                                    if moved:
+                                        self.changed.put(service)
 
                 except (subprocess.TimeoutExpired, ValueError, IndexError) as e:
                     logger.debug(f"Error looking up service {service_name}: {e}")
@@ -160,6 +200,8 @@ class ServiceDiscovery:
                 for name in services_to_remove:
                     del self.services[name]
                     logger.info(f"Removed service: {name}")
+                if services_to_remove:
+                    self.version += 1
 
         except FileNotFoundError:
             logger.error("dns-sd not found. Please install Bonjour services (Windows) or ensure dns-sd is available.")
@@ -167,6 +209,19 @@ class ServiceDiscovery:
         except Exception as e:
             logger.error(f"Error during service discovery: {e}")
 
+    def _resolve(self, hostname: str) -> str:
+        # every round re-resolves the same few hosts, and an mDNS lookup can block for seconds
+        cached = self._resolved.get(hostname)
+        now = time.monotonic()
+        if cached and now - cached[0] < DNS_CACHE_TTL:
+            return cached[1]
+        try:
+            ip_address = socket.gethostbyname(hostname)
+        except socket.gaierror:
+            return hostname
+        self._resolved[hostname] = (now, ip_address)
+        return ip_address
+
     def get_all_services(self) -> List[AIService]:
         with self.lock:
             return list(self.services.values())
@@ -175,98 +230,168 @@ class ServiceDiscovery:
         with self.lock:
             return self.services.get(name)
 
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+
     def stop(self):
         self.running = False
 
 class HealthMonitor:
-    def __init__(self, discovery: ServiceDiscovery, check_interval: int = 20):
+    # services are probed when discovery reports them, lazily before routing (see ensure_fresh) and,
+    # while unhealthy, every UNHEALTHY_RECHECK_INTERVAL; the full sweep every check_interval is a safety net
+    def __init__(self, discovery: ServiceDiscovery, check_interval: int = 100):
         self.discovery = discovery
         self.check_interval = check_interval
         self.running = True
+        # probes reuse kept-alive connections instead of reconnecting to every service each round
+        self.session = _make_session()
+        # probe services concurrently so a round takes as long as the slowest service, not all of them added up
+        self._pool = ThreadPoolExecutor(max_workers=HEALTH_CHECK_WORKERS, thread_name_prefix="hc")
         self.thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self.thread.start()
 
     def _monitor_loop(self):
+        next_sweep = 0.0
+        next_recheck = UNHEALTHY_RECHECK_INTERVAL
         while self.running:
-            services = self.discovery.get_all_services()
+            now = time.monotonic()
+            if now >= next_sweep:
+                services = self.discovery.get_all_services()
+                next_sweep = now + self.check_interval
+                next_recheck = now + UNHEALTHY_RECHECK_INTERVAL
+            elif now >= next_recheck:
+                services = [s for s in self.discovery.get_all_services() if not s.is_healthy]
+                next_recheck = now + UNHEALTHY_RECHECK_INTERVAL
+            else:
+                services = self._wait_for_changes(min(next_sweep, next_recheck) - now)
             
-            for service in services:
-                was_healthy = service.is_healthy
-                service.is_healthy = self._check_health(service.url)
-                service.last_seen = datetime.now()
-                
-                if service.is_healthy:
-                    service.available_models = self._fetch_models(service.url)
-                
-                if service.first_check_complete and service.is_healthy != was_healthy:
-                    status = "healthy" if service.is_healthy else "unhealthy"
-                    logger.info(f"{service.name} is now {status}")
-                
-                service.first_check_complete = True
-
-            time.sleep(self.check_interval)
+            # drain the iterator so the round finishes before we wait again
+            for _ in self._pool.map(self._probe_once, services):
+                pass
+        # torn down here rather than in stop(), which could otherwise pull the pool out from under map()
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+    def _wait_for_changes(self, timeout: float) -> List[AIService]:
+        """Block until discovery reports new/moved services (or timeout), then take everything queued"""
+        try:
+            pending = [self.discovery.changed.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                pending.append(self.discovery.changed.get_nowait())
+            except queue.Empty:
+                break
+        # None is stop()'s wake-up; a service reported twice only needs one probe
+        return list({id(s): s for s in pending if s is not None}.values())
+
+    def ensure_fresh(self, service: AIService) -> bool:
+        """Re-probe a service whose last check is older than HEALTH_TTL; returns whether it's healthy"""
+        if time.monotonic() - service.health_checked_at > HEALTH_TTL:
+            self._probe_once(service, HEALTH_TTL)
+        return service.is_healthy
+
+    def _probe_once(self, service: AIService, max_age: float = 0.0):
+        # whoever gets the lock probes; anyone queued behind it reuses that result instead of probing again
+        started = time.monotonic()
+        with service.probe_lock:
+            if started - service.health_checked_at <= max_age:
+                return
+            self._probe(service)
+
+    def _probe(self, service: AIService):
+        # each change bumps the discovery version right away, so the router stops (or starts) using
+        # this service without waiting for the rest of the round's probes to finish
+        was_healthy = service.is_healthy
+        service.is_healthy = self._check_health(service.url)
+        service.last_seen = datetime.now()
+        service.health_checked_at = time.monotonic()
+        if service.is_healthy != was_healthy:
+            self.discovery.bump_version()
+        
+        if service.is_healthy:
+            models = self._fetch_models(service.url)
+            if models != service.available_models:
+                service.available_models = models
+                self.discovery.bump_version()
+        
+        if service.first_check_complete and service.is_healthy != was_healthy:
+            status = "healthy" if service.is_healthy else "unhealthy"
+            logger.info(f"{service.name} is now {status}")
+        
+        service.first_check_complete = True
 
     def _check_health(self, url: str) -> bool:
         try:
-            response = requests.get(f"{url}/v1/health", timeout=3)
+            response = self.session.get(f"{url}/v1/health", timeout=3)
             return response.status_code == 200
         except Exception:
             return False
 
-    def _fetch_models(self, url: str) -> List[str]:
+    def _fetch_models(self, url: str) -> Tuple[str, ...]:
         try:
-            response = requests.get(f"{url}/v1/models", timeout=5)
+            response = self.session.get(f"{url}/v1/models", timeout=5)
             if response.status_code == 200:
                 data = response.json()
-                return [model["id"] for model in data.get("models", [])]
+                # the same few model ids come back every cycle; interning keeps one copy and
+                # lets the router's membership checks compare by identity first
+                return tuple(sys.intern(model["id"]) for model in data.get("models", []))
         except Exception as e:
             logger.debug(f"Failed to fetch models from {url}: {e}")
-        return []
+        return ()
 
     def stop(self):
         self.running = False
+        # wakes _wait_for_changes so the loop sees running=False and cleans up after itself
+        self.discovery.changed.put(None)
 
 class ModelRouter:
-    def __init__(self, discovery: ServiceDiscovery):
+    def __init__(self, discovery: ServiceDiscovery, health_monitor: Optional[HealthMonitor] = None):
         self.discovery = discovery
-
-    def get_all_models(self) -> Dict[str, List[Dict[str, str]]]:
-        services = self.discovery.get_all_services()
-        healthy_services = [s for s in services if s.is_healthy]
+        self.health_monitor = health_monitor
+        self.session = _make_session()
+        # (discovery version, model_id -> healthy services by priority, /v1/models response)
+        self._index: Tuple[int, Dict[str, List[AIService]], Dict[str, List[Dict[str, str]]]] = (-1, {}, {"models": []})
+
+    def _model_index(self) -> Tuple[Dict[str, List[AIService]], Dict[str, List[Dict[str, str]]]]:
+        """Rebuild the model -> candidates index only when discovery/health state has changed"""
+        version, index, models = self._index
+        current = self.discovery.version
+        if version == current:
+            return index, models
+        
+        healthy_services = sorted((s for s in self.discovery.get_all_services() if s.is_healthy),
+                                  key=lambda s: s.priority)
         
         all_models = []
-        model_to_services: Dict[str, List[str]] = {}
+        index = {}
         
         for service in healthy_services:
             for model_id in service.available_models:
-                if model_id not in model_to_services:
-                    model_to_services[model_id] = []
+                if model_id not in index:
+                    index[model_id] = []
                     all_models.append({
                         "id": model_id,
                         "object": "model",
                         "owned_by": service.name
                     })
-                model_to_services[model_id].append(service.name)
+                index[model_id].append(service)
         
-        return {"models": all_models}
+        models = {"models": all_models}
+        self._index = (current, index, models)
+        return index, models
+
+    def get_all_models(self) -> Dict[str, List[Dict[str, str]]]:
+        return self._model_index()[1]
 
     def get_service_for_model(self, model_id: str) -> Optional[AIService]:
-        services = self.discovery.get_all_services()
-        healthy_services = [s for s in services if s.is_healthy]
-        
-        candidates = [s for s in healthy_services if model_id in s.available_models]
-        
-        if not candidates:
-            return None
-        
-        candidates.sort(key=lambda s: s.priority)
-        return candidates[0]
+        candidates = self._model_index()[0].get(model_id)
+        return candidates[0] if candidates else None
 
     def route_request(self, model_id: str, request_data: dict, max_retries: int = 2):
-        services = self.discovery.get_all_services()
-        healthy_services = [s for s in services if s.is_healthy]
-        
-        candidates = [s for s in healthy_services if model_id in s.available_models]
+        candidates = self._model_index()[0].get(model_id)
         
         if not candidates:
             raise HTTPException(
@@ -274,16 +399,22 @@ class ModelRouter:
                 detail=f"Model '{model_id}' not found in any available service"
             )
         
-        candidates.sort(key=lambda s: s.priority)
-        
         is_streaming = request_data.get("stream", False)
         
         last_error = None
-        for service in candidates[:max_retries]:
+        attempts = 0
+        for service in candidates:
+            if attempts >= max_retries:
+                break
+            # cached health is fine while it's recent; past HEALTH_TTL check before sending anything
+            if self.health_monitor and not self.health_monitor.ensure_fresh(service):
+                last_error = f"Service {service.name} is unhealthy"
+                continue
+            attempts += 1
             try:
                 logger.info(f"Routing '{model_id}' request to {service.name} at {service.url}")
                 #this is where the proxy receives the request and forwards it to the selected service
-                response = requests.post(
+                response = self.session.post(
                     f"{service.url}/v1/chat/completions",
                     json=request_data,
                     timeout=120,
@@ -291,6 +422,8 @@ class ModelRouter:
                 )
                 
                 if response.status_code != 200:
+                    # a streamed body is never read, so hand the connection back to the pool before moving on
+                    response.close()
                     raise ValueError(f"Service returned status {response.status_code}")
                 
                 if is_streaming:
@@ -300,6 +433,7 @@ class ModelRouter:
                         result = response.json()
                         
                         if "choices" not in result:
+                            response.close()
                             raise ValueError(f"Invalid response format: missing 'choices' field")
                         
                         logger.info(f"Successfully routed to {service.name}")
@@ -307,6 +441,7 @@ class ModelRouter:
                     except json.JSONDecodeError as e:
                         logger.error(f"Failed to parse JSON response: {e}")
                         logger.error(f"Response text: {response.text[:1000]}")
+                        response.close()
                         raise ValueError(f"Service returned invalid JSON: {str(e)}")
                 
             except requests.Timeout:
@@ -328,11 +463,28 @@ class ProxyManager:
     def __init__(self):
         self.discovery = ServiceDiscovery()
         self.health_monitor = HealthMonitor(self.discovery)
-        self.router = ModelRouter(self.discovery)
+        self.router = ModelRouter(self.discovery, self.health_monitor)
 
     def stop(self):
         self.health_monitor.stop()
         self.discovery.stop()
+        self.router.session.close()
+
+_proxy_manager: Optional[ProxyManager] = None
+
+# built per process, so with --workers every worker runs its own discovery and health monitor
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _proxy_manager
+    _proxy_manager = ProxyManager()
+
+    logger.info("Waiting for service discovery...")
+    await asyncio.sleep(3)
+
+    yield
+
+    logger.info("Shutting down proxy...")
+    _proxy_manager.stop()
 
 app = FastAPI(
     title="Saturn Local Proxy",
@@ -342,11 +494,10 @@ app = FastAPI(
         "name": "Joey Perrello",
         "url": "https://jperrello.netlify.app/",
         "email": "jperrell@ucsc.edu",
-    }
+    },
+    lifespan=lifespan
 )
 
-_proxy_manager: Optional[ProxyManager] = None
-
 def get_proxy_manager() -> ProxyManager:
     if _proxy_manager is None:
         raise HTTPException(status_code=503, detail="Proxy not initialized")
@@ -406,22 +557,24 @@ async def chat_completions(
     if request.max_tokens is not None:
         request_dict["max_tokens"] = request.max_tokens
     
-    response = manager.router.route_request(request.model, request_dict)
+    # route_request and the upstream stream both block on the network, so keep them off the event loop;
+    # otherwise one slow upstream stalls every other request the proxy is serving
+    response = await run_in_threadpool(manager.router.route_request, request.model, request_dict)
     
     if request.stream:
         async def generate():
             chunk_count = 0
             try:
-                for chunk in response.iter_content(chunk_size=None):
+                async for chunk in iterate_in_threadpool(response.iter_content(chunk_size=None)):
                     if await raw_request.is_disconnected(): #if the person hits big red stop button
                         logger.info(f"Client disconnected after {chunk_count} chunks. Stopping stream.")
                         break
                     
                     if chunk:
                         chunk_count += 1
-                        decoded_chunk = chunk.decode('utf-8')
-                        
-                        logger.debug(f"Chunk {chunk_count}: {decoded_chunk[:200]}")
+                        # only decode (the first 200 bytes) when someone will actually see it
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"Chunk {chunk_count}: {chunk[:200].decode('utf-8', 'replace')}")
                         
                         yield chunk
                 
@@ -465,11 +618,10 @@ def find_port_number(host: str, start_port=8080, max_attempts=20) -> int:
         f"No available ports in range {start_port} - {start_port + max_attempts}"
     )
 def main():
-    global _proxy_manager
-
     parser = argparse.ArgumentParser(description="Saturn Proxy")
     parser.add_argument("--host", type=str, default="127.0.0.1")
     parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
     args = parser.parse_args()
 
     port = args.port if args.port else find_port_number(args.host)
@@ -482,16 +634,16 @@ def main():
     print(f"To configure:Open Jan Setting -> Model Providers -> Add Provider -> Any name -> Api Key = Any string -> Base URL = http://{args.host}:{port}/v1")
     print()
 
-    _proxy_manager = ProxyManager()
+    # uvicorn's "auto" loop/http already use uvloop + httptools when they're installed
+    if sys.platform != "win32" and importlib.util.find_spec("uvloop") is None:
+        logger.info("uvloop not installed, using the asyncio event loop (pip install \"uvicorn[standard]\" for the faster one)")
 
-    logger.info("Waiting for service discovery...")
-    time.sleep(3)
-
-    try:
+    if args.workers > 1:
+        # worker processes have to import the app themselves, so uvicorn needs it as an import string
+        app_path = f"{__spec__.name if __spec__ else 'local_proxy_client'}:app"
+        uvicorn.run(app_path, host=args.host, port=port, log_level="info", workers=args.workers)
+    else:
         uvicorn.run(app, host=args.host, port=port, log_level="info")
-    finally:
-        logger.info("Shutting down proxy...")
-        _proxy_manager.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,6 +4,7 @@ import time
 import requests
 import threading
 import re
+from collections import deque
 from typing import Dict, List, Optional
 from dataclasses import dataclass
 from datetime import datetime
@@ -13,6 +14,9 @@ from datetime import datetime
 # Linux: avahi-browse _saturn._tcp -t
 # For details: dns-sd -L <service_name> _saturn._tcp (or avahi-browse _saturn._tcp -t -r)
 
+# Keep the last 10 exchanges (user + assistant) so the prompt can't grow without bound
+MAX_HISTORY_MESSAGES = 20
+
 @dataclass
 class SaturnService:
     name: str
@@ -29,6 +33,8 @@ class ServiceDiscovery:
         self.running = True
         self.discovery_interval = discovery_interval
         self.on_service_change = on_service_change
+        # set once the first discovery pass finishes, whether or not it found anything
+        self.first_pass = threading.Event()
         self.thread = threading.Thread(target=self._discovery_loop, daemon=True)
         self.thread.start()
 
@@ -39,6 +45,7 @@ class ServiceDiscovery:
                 self._discover_services()
             except Exception as e:
                 print(f"Discovery error: {e}")
+            self.first_pass.set()
             time.sleep(self.discovery_interval)
 
     def _discover_services(self):
@@ -381,7 +388,7 @@ def main():
     discovery = ServiceDiscovery(discovery_interval=10, on_service_change=handle_service_change)
 
     # Wait for initial discovery
-    time.sleep(3)
+    discovery.first_pass.wait(timeout=10)
 
     best_service = discovery.get_best_service()
     if not best_service:
@@ -397,7 +404,7 @@ def main():
     models_response = requests.get(f"{current_service_url}/v1/models")
     model = (models_response.json().get('models', []))[0]['id'] if models_response.ok else None
 
-    chat_history = []
+    chat_history = deque(maxlen=MAX_HISTORY_MESSAGES)
 
     print("\nChat started. Type 'quit' to exit, 'clear' to clear history, 'servers' to list available servers.")
 
@@ -425,7 +432,7 @@ def main():
             if user_input.lower() == "quit":
                 break
             elif user_input.lower() == "clear":
-                chat_history = []
+                chat_history.clear()
                 print("Chat history cleared.")
                 continue
             elif user_input.lower() == "servers":
@@ -442,7 +449,7 @@ def main():
             if not user_input:
                 continue
 
-            current_message = chat_history + [{"role": "user", "content": user_input}]
+            current_message = [*chat_history, {"role": "user", "content": user_input}]
             payload = {
                 "model": model,
                 "messages": current_message
@@ -1,20 +1,46 @@
 from pydantic import BaseModel, Field
+import atexit
+import json
 import requests
+from requests.adapters import HTTPAdapter
 import socket
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
+from functools import cached_property
 from typing import Dict, List, Optional, Generator, Union
 
 from zeroconf import Zeroconf, ServiceBrowser, ServiceListener
 
+# orjson is much faster on the large message payloads chat requests carry, but it's optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 SATURN = "_saturn._tcp.local."
 DEFAULT_PRIORITY = 50
 DISCOVERY_SETTLE_TIME = 3.0
 HEALTH_CHECK_TIMEOUT = 5
 REQUEST_TIMEOUT_DEFAULT = 60
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 20
+MODEL_FETCH_WORKERS = 8
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 @dataclass
@@ -25,14 +51,23 @@ class SaturnService:
     priority: int = DEFAULT_PRIORITY
     last_seen: datetime = field(default_factory=datetime.now)
 
-    @property
+    # services are rebuilt rather than mutated when their address changes, so these never go stale
+    @cached_property
     def base_url(self) -> str:
         return f"http://{self.address}:{self.port}"
 
+    @cached_property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/v1/chat/completions"
+
 
 class SaturnServiceListener(ServiceListener):
     def __init__(self) -> None:
         self.services: Dict[str, SaturnService] = {}
+        # read-only copy handed out by get_services, rebuilt only when services change
+        self._snapshot: Dict[str, SaturnService] = {}
+        # last seen (address, port, priority, txt) per service, so refreshes that change nothing skip the rebuild
+        self._signatures: Dict[str, tuple] = {}
         self.lock = threading.Lock()
         self.service_found = threading.Event()
 
@@ -41,7 +76,19 @@ class SaturnServiceListener(ServiceListener):
         if not info or not info.addresses:
             return
 
+        clean_name = name.replace(f".{type_}", "").replace(f"._saturn._tcp.local.", "")
+        signature = (
+            info.addresses[0],
+            info.port,
+            info.priority,
+            frozenset(info.properties.items()) if info.properties else None,
+        )
+
         with self.lock:
+            if self._signatures.get(clean_name) == signature and clean_name in self.services:
+                self.services[clean_name].last_seen = datetime.now()
+                return
+
             address = socket.inet_ntoa(info.addresses[0])
             port = info.port
             priority = info.priority if info.priority else DEFAULT_PRIORITY
@@ -54,8 +101,6 @@ class SaturnServiceListener(ServiceListener):
                     except (ValueError, UnicodeDecodeError):
                         pass
 
-            clean_name = name.replace(f".{type_}", "").replace(f"._saturn._tcp.local.", "")
-
             self.services[clean_name] = SaturnService(
                 name=clean_name,
                 address=address,
@@ -63,20 +108,23 @@ class SaturnServiceListener(ServiceListener):
                 priority=priority,
                 last_seen=datetime.now()
             )
+            self._snapshot = dict(self.services)
+            self._signatures[clean_name] = signature
             self.service_found.set()
 
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         clean_name = name.replace(f".{type_}", "").replace(f"._saturn._tcp.local.", "")
         with self.lock:
+            self._signatures.pop(clean_name, None)
             if clean_name in self.services:
                 del self.services[clean_name]
+                self._snapshot = dict(self.services)
 
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         self.add_service(zc, type_, name)
 
     def get_services(self) -> Dict[str, SaturnService]:
-        with self.lock:
-            return dict(self.services)
+        return self._snapshot
 
 
 class SaturnDiscovery:
@@ -123,6 +171,21 @@ class SaturnDiscovery:
         return False
 
 
+# Open WebUI may build a new Pipe whenever the function is reloaded or its valves change,
+# so every instance shares one browser instead of starting (and leaking) its own.
+_shared_discovery: Optional[SaturnDiscovery] = None
+_shared_discovery_lock = threading.Lock()
+
+
+def _get_shared_discovery() -> SaturnDiscovery:
+    global _shared_discovery
+    with _shared_discovery_lock:
+        if _shared_discovery is None:
+            _shared_discovery = SaturnDiscovery()
+            atexit.register(_shared_discovery.stop)
+        return _shared_discovery
+
+
 class Pipe:
     class Valves(BaseModel):
         NAME_PREFIX: str = Field(
@@ -148,12 +211,18 @@ class Pipe:
 
     def __init__(self) -> None:
         self.valves = self.Valves()
-        self.discovery = SaturnDiscovery()
+        self.discovery = _get_shared_discovery()
         self.last_discovery_time: float = 0
         self.cached_services: Dict[str, SaturnService] = {}
         self.model_service_map: Dict[str, List[Dict]] = {}
         self.lock = threading.Lock()
         self._discovery_started = False
+        # one pooled session for every Saturn service so model listings and chat
+        # requests reuse keep-alive connections instead of reconnecting each call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def _ensure_discovery_started(self) -> None:
         if not self._discovery_started:
@@ -162,11 +231,11 @@ class Pipe:
             self._discovery_started = True
 
     def _get_services(self) -> Dict[str, SaturnService]:
-        current_time = time.time()
+        current_time = time.monotonic()
 
         with self.lock:
             if current_time - self.last_discovery_time < self.valves.CACHE_TTL and self.cached_services:
-                return self.cached_services.copy()
+                return self.cached_services
 
         self._ensure_discovery_started()
         services = self.discovery.get_services()
@@ -179,12 +248,12 @@ class Pipe:
 
     def _fetch_models_from_service(self, service: SaturnService) -> List[Dict]:
         try:
-            r = requests.get(
+            r = self.session.get(
                 f"{service.base_url}/v1/models",
                 timeout=HEALTH_CHECK_TIMEOUT
             )
             r.raise_for_status()
-            models_data = r.json()
+            models_data = _json_loads(r.content)
 
             models_list = models_data.get("data") or models_data.get("models", [])
 
@@ -219,8 +288,12 @@ class Pipe:
             all_models: List[Dict] = []
             model_to_services: Dict[str, List[Dict]] = {}
 
-            for service in services.values():
-                models = self._fetch_models_from_service(service)
+            # probe every service at once (bounded) so a slow host doesn't serialize the listing
+            workers = min(len(services), MODEL_FETCH_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(self._fetch_models_from_service, services.values()))
+
+            for models in results:
                 for model in models:
                     all_models.append(model)
                     model_id = model["model_id"]
@@ -302,9 +375,9 @@ class Pipe:
         payload: dict,
         stream: bool
     ) -> Union[Dict, Generator]:
-        r = requests.post(
-            url=f"{service.base_url}/v1/chat/completions",
-            json=payload,
+        r = self.session.post(
+            url=service.chat_url,
+            data=_json_dumps(payload),
             headers={"Content-Type": "application/json"},
             stream=stream,
             timeout=self.valves.REQUEST_TIMEOUT
@@ -315,7 +388,7 @@ class Pipe:
         if stream:
             return self._stream_response(r)
         else:
-            return r.json()
+            return _json_loads(r.content)
 
     def _stream_response(self, response: requests.Response) -> Generator:
         try:
@@ -1,11 +1,57 @@
+import atexit
+import json
+import os
+import selectors
+import sys
 import time
 import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import socket
+from types import MappingProxyType
 from enum import Enum
 from zeroconf import ServiceListener, ServiceBrowser, Zeroconf
-from typing import Callable, Optional
-from collections import defaultdict
+from typing import Callable, Iterator, Optional
+from collections import defaultdict, deque
+
+# orjson is noticeably quicker on completion-sized bodies; fall back to the stdlib if it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_SERVICE_TYPE = "_zeroconfai._tcp.local."
+
+# shared across chat turns and health checks so each request reuses the kept-alive connection to the service
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=0))
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+atexit.register(_SESSION.close)
+
+# how long a health result is trusted before we probe the service again
+_HEALTH_TTL = 3.0
+# (connect, read) so an unreachable host fails fast
+_HEALTH_TIMEOUT = (0.5, 1.0)
+# origins that rejected HEAD with a 405 get probed with GET from then on
+_HEALTH_METHOD = {}
+
+# built once instead of letting requests assemble them on every post
+_JSON_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+_STREAM_HEADERS = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
  
 class ServiceEvent(Enum):
@@ -14,63 +60,75 @@ class ServiceEvent(Enum):
     UPDATED = "updated"
 
 class ServiceManager:
-    _instance = None
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance=super().__new__(cls)
-        return cls._instance
-    
     def __init__(self):
-        if not hasattr(self, "_initialized"):
-            self._initialized = True
-            self.services = {}
-            self._lock = threading.Lock()
-            self._health_cache = {}
-            self.zc = Zeroconf()
-            self.ai_listener = ZeroconfAIListener(service_manager=self)
-            self.browser = ServiceBrowser(self.zc, "_zeroconfai._tcp.local.", self.ai_listener)
-            self._event_callbacks = []
+        self.services = {}
+        # read-only copy republished after every write so readers never need the lock
+        self._snapshot = MappingProxyType({})
+        self._lock = threading.Lock()
+        self._health_cache = {}
+        self.discovered = threading.Event()
+        # tuple so dispatch iterates a frozen snapshot; rebuilt on (rare) registration
+        self._event_callbacks = ()
+        self.zc = Zeroconf()
+        self.ai_listener = ZeroconfAIListener(service_manager=self)
+        self.browser = ServiceBrowser(self.zc, _SERVICE_TYPE, self.ai_listener)
 
     def add_service_to_manager(self, name: str, url: str, info: dict = None):
+        info = info or {}
         with self._lock:
-            if name in self.services and self.services[name]["url"] == url:
-                print(f"The service: {name} is already registered at {url}")
-                return
-            self.services[name] = {"url": url, "info": info or {}}
-            self._health_cache[url] = (time.time(), True)
-        self._notify_event(ServiceEvent.ADDED, name, url)
+            existing = self.services.get(name)
+            if existing is not None and existing["url"] == url:
+                # mDNS refresh of a service we already have; only txt props can differ
+                if existing["info"] == info:
+                    return
+                event = ServiceEvent.UPDATED
+            else:
+                event = ServiceEvent.ADDED
+            self.services[name] = {"url": url, "info": info}
+            self._snapshot = MappingProxyType(dict(self.services))
+            # only a real probe may vouch for a url; drop anything cached for it so the next verify_health checks
+            self._health_cache.pop(url, None)
+        self.discovered.set()
+        self._notify_event(event, name, url)
 
     def remove_service_from_manager(self, name: str):
         with self._lock:
-            if name in self.services:
-                url = self.services[name]["url"]
-                del self.services[name]
-                if url in self._health_cache:
-                    del self._health_cache[url]
-                self._notify_event(ServiceEvent.REMOVED, name, url)
-            else:
+            if name not in self.services:
                 print(f"Tried to remove unknown service: {name}")
+                return
+            url = self.services[name]["url"]
+            del self.services[name]
+            self._snapshot = MappingProxyType(dict(self.services))
+            if url in self._health_cache:
+                del self._health_cache[url]
+        self._notify_event(ServiceEvent.REMOVED, name, url)
 
     def is_service_available(self, name: str) -> bool:
-        with self._lock:
-            return name in self.services
+        return name in self._snapshot
     
     def get_service_url(self, name: str) -> Optional[str]:
-        with self._lock:
-            if name in self.services:
-                return self.services[name]["url"]
-            return None
+        service = self._snapshot.get(name)
+        return service["url"] if service else None
         
+    def verify_health(self, url: str, timeout=_HEALTH_TIMEOUT) -> bool:
+        with self._lock:
+            cached = self._health_cache.get(url)
+        if cached and time.monotonic() - cached[0] < _HEALTH_TTL:
+            return cached[1]
+        ok = check_health(url, timeout=timeout)
+        with self._lock:
+            self._health_cache[url] = (time.monotonic(), ok)
+        return ok
+
     def on_service_event(self, callback: Callable[[ServiceEvent, str, str], None]) -> None:
-        self._event_callbacks.append(callback)
+        self._event_callbacks = (*self._event_callbacks, callback)
 
     def _notify_event(self, event: ServiceEvent, name: str, url: str) -> None:
         for callback in self._event_callbacks:
             try:
                 callback(event, name, url)
             except Exception as e:
-                print(f"Error in event callback: {e}")        
+                print(f"Error in event callback: {e}")
     
     
     def get_healthy_services(self):
@@ -78,54 +136,88 @@ class ServiceManager:
             return [(name, info["url"]) for name, info in self.services.items()]
     
     def __iter__(self):
-        with self._lock:
-            return iter(list(self.services.keys()))
+        return iter(self._snapshot)
     
     def __len__(self):
-        with self._lock:
-            return len(self.services)
+        return len(self._snapshot)
     
     def __contains__(self, name: str) -> bool:
-        with self._lock:
-            return name in self.services
+        return name in self._snapshot
     
     def items(self):
-        with self._lock:
-            return [(name, info["url"]) for name, info in self.services.items()]
+        return self.snapshot_urls()
+
+    def snapshot_urls(self) -> tuple[tuple[str, str], ...]:
+        return tuple((name, info["url"]) for name, info in self._snapshot.items())
     
 
 
+_MANAGER: Optional[ServiceManager] = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_service_manager() -> ServiceManager:
+    # one Zeroconf instance per process; the lock stops two threads starting a second browser
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = ServiceManager()
+    return _MANAGER
+
+
+def _txtstr(props: dict, key: bytes) -> str:
+    # missing keys and valueless txt entries (None) both come back as ''
+    value = props.get(key)
+    return value.decode('utf-8') if value else ''
+
+
 class ZeroconfAIListener(ServiceListener):
     def __init__(self, service_manager):
         self.service_manager = service_manager
 
-    def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        info = zc.get_service_info(type_, name)
+    def add_service(self, zc: Zeroconf, type_: str, name: str, timeout: int = 3000) -> None:
+        info = zc.get_service_info(type_, name, timeout=timeout)
 
         if info:
             address=socket.inet_ntoa(info.addresses[0])
             port=info.port
             url = f"http://{address}:{port}"
+            props = info.properties
             service_info = {
-                "version": info.properties.get(b'version', b'').decode('utf-8'),
-                "api": info.properties.get(b'api', b'').decode('utf-8'),
+                "version": _txtstr(props, b'version'),
+                "api": _txtstr(props, b'api'),
                 "priority": info.priority
             }
             self.service_manager.add_service_to_manager(name, url, service_info)
     
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        self.add_service(zc, type_, name)
+        # the record is usually already cached by zeroconf, so don't block long on a refresh
+        self.add_service(zc, type_, name, timeout=200)
 
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         self.service_manager.remove_service_from_manager(name)
 
   
 class ZeroconfAIClient:
-    def __init__(self, service_manager: ServiceManager, service_name: str = None):
-        self.service_manager = service_manager
+    def __init__(self, service_manager: ServiceManager = None, service_name: str = None, max_history: int = 10):
+        self.service_manager = service_manager or get_service_manager()
         self._active_service_name = service_name
-        self.chat_history = []
+        # user/assistant pairs are appended together, so an even maxlen drops whole exchanges
+        self.chat_history = deque(maxlen=max_history * 2)
+        # bumped on every invalidation, so is_connected never stores a result computed before an event landed
+        self._connected_gen = 0
         self.service_available = False
+        self.session = _SESSION
+
+        # lets a service event interrupt a blocked prompt; selecting on stdin doesn't work on Windows
+        self._wake_r, self._wake_w = os.pipe() if os.name != "nt" else (None, None)
+        if self._wake_r is not None:
+            # non-blocking so prompt() can drain every pending wake and a full pipe never stalls the event thread
+            os.set_blocking(self._wake_r, False)
+            os.set_blocking(self._wake_w, False)
+        # bytes read from the stdin fd but not yet returned as a line (a paste can deliver several at once)
+        self._stdin_buf = b""
 
         self.service_manager.on_service_event(self._handle_service_event)
 
@@ -142,9 +234,15 @@ class ZeroconfAIClient:
         
     def _handle_service_event(self, event: ServiceEvent, name: str, url: str):
         if name == self._active_service_name:
+            self._invalidate_connected()
             if event == ServiceEvent.REMOVED:
                 print(f"Active service {name} at {url} has been removed.")
                 self.service_available = False
+                if self._wake_w is not None:
+                    try:
+                        os.write(self._wake_w, b"!")
+                    except OSError:
+                        pass  # pipe already full (a wake is pending anyway) or closed on shutdown
             elif event == ServiceEvent.ADDED:
                 print(f"Active service {name} at {url} has been added.")
                 self.service_available = True
@@ -152,11 +250,33 @@ class ZeroconfAIClient:
     def set_active_service(self, service_name: str):
         self._validate_and_set_service(service_name)
 
+    @property
+    def service_available(self) -> bool:
+        return self._service_available
+
+    @service_available.setter
+    def service_available(self, value: bool):
+        self._service_available = value
+        self._invalidate_connected()
+
+    def _invalidate_connected(self):
+        self._connected_gen += 1
+        self._connected_cached = None
+
     @property
     def is_connected(self) -> bool:
-        return (self._active_service_name is not None and 
-                self.service_available and 
+        # recomputed only after a service event or an availability change touches the active service
+        cached = self._connected_cached
+        if cached is None:
+            gen = self._connected_gen
+            cached = (
+                self._active_service_name is not None and
+                self._service_available and
                 self.service_manager.is_service_available(self._active_service_name))
+            # an event on the zeroconf thread mid-computation makes this answer stale; don't keep it
+            if gen == self._connected_gen:
+                self._connected_cached = cached
+        return cached
     
     def get_available_models(self) -> list[str]:
         if not self.is_connected:
@@ -167,9 +287,9 @@ class ZeroconfAIClient:
             raise RuntimeError(f"Could not get URL for service {self._active_service_name}")
         
         try:
-            response = requests.get(f"{url}/v1/models", timeout=5.0)
+            response = self.session.get(f"{url}/v1/models", timeout=5.0)
             response.raise_for_status()
-            data = response.json()
+            data = _json_loads(response.content)
             models = data.get('models', [])
             # Handle both list of strings and list of dicts
             if models and isinstance(models[0], dict):
@@ -179,11 +299,11 @@ class ZeroconfAIClient:
             print(f"Warning: Could not fetch models from {self._active_service_name}: {e}")
             return []
     
-    def chat(self, user_message: str, model: str = None, max_history: int = 10) -> str:
+    def _prepare_chat(self, user_message: str, model: str) -> tuple[str, dict]:
         # Try to reconnect if service was previously unavailable
         if not self.service_available and self._active_service_name:
             url = self.service_manager.get_service_url(self._active_service_name)
-            if url and check_health(url, timeout=2.0):
+            if url and check_health(url):
                 self.service_available = True
                 print(f"Service {self._active_service_name} is available again")
 
@@ -204,20 +324,22 @@ class ZeroconfAIClient:
             model = available_models[0]  # Use first available model
             print(f"Using default model: {model}")
 
-        if len(self.chat_history) > max_history * 2:
-            self.chat_history = self.chat_history[2:]
-        
-        current_message = self.chat_history + [{"role": "user", "content": user_message}]
+        current_message = [*self.chat_history, {"role": "user", "content": user_message}]
         
         payload = {
             "model": model,
             "messages": current_message,
         }
+        return url, payload
+
+    def chat(self, user_message: str, model: str = None) -> str:
+        url, payload = self._prepare_chat(user_message, model)
 
         try:
-            response = requests.post(f"{url}/v1/chat/completions", json=payload)
+            body = _json_dumps(payload)
+            response = self.session.post(f"{url}/v1/chat/completions", data=body, headers=_JSON_HEADERS, timeout=(3.05, 60))
             response.raise_for_status()
-            data = response.json()
+            data = _json_loads(response.content)
             assistant_message = data['choices'][0]['message']['content']
             self.chat_history.append({"role": "user", "content": user_message})
             self.chat_history.append({"role": "assistant", "content": assistant_message})
@@ -225,9 +347,95 @@ class ZeroconfAIClient:
         except requests.RequestException as e:
             self.service_available = False
             raise RuntimeError(f"Error communicating with the AI service {self._active_service_name}: {e}")
+
+    @staticmethod
+    def _iter_sse_content(response) -> Iterator[str]:
+        # raw bytes, decoded as utf-8 ourselves: requests would fall back to latin-1 for text/* without a charset
+        for raw_line in response.iter_lines():
+            if not raw_line.startswith(b"data: "):
+                continue
+            data = raw_line[6:]
+            if data == b"[DONE]":
+                break
+            try:
+                chunk = _json_loads(data)
+            except ValueError:
+                continue
+            choices = chunk.get("choices") or [{}]
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                yield content
+
+    def chat_stream(self, user_message: str, model: str = None) -> Iterator[str]:
+        # same as chat() but yields tokens as the service sends them instead of waiting for the whole reply
+        url, payload = self._prepare_chat(user_message, model)
+        payload["stream"] = True
+
+        body = _json_dumps(payload)
+        parts = []
+        try:
+            # with stream=True the read timeout is per socket read, i.e. at most 60s of silence between chunks
+            with self.session.post(f"{url}/v1/chat/completions", data=body, headers=_STREAM_HEADERS, stream=True, timeout=(3.05, 60)) as response:
+                response.raise_for_status()
+                if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    for content in self._iter_sse_content(response):
+                        parts.append(content)
+                        yield content
+                else:
+                    # server ignored "stream" (old_server does) and sent the whole reply as one JSON body
+                    content = _json_loads(response.content)['choices'][0]['message']['content']
+                    if content:
+                        parts.append(content)
+                        yield content
+        except requests.RequestException as e:
+            self.service_available = False
+            raise RuntimeError(f"Error communicating with the AI service {self._active_service_name}: {e}")
+
+        self.chat_history.append({"role": "user", "content": user_message})
+        self.chat_history.append({"role": "assistant", "content": "".join(parts)})
         
+    def prompt(self, text: str) -> Optional[str]:
+        # like input(), but returns None if the active service dropped while we were waiting
+        # (piped/redirected stdin can't be selected on everywhere, and there's nobody waiting at it anyway)
+        if self._wake_r is None or not sys.stdin.isatty():
+            return input(text)
+        print(text, end="", flush=True)
+        # read the raw fd ourselves: sys.stdin.readline() would buffer the rest of a paste where select can't see it
+        fd = sys.stdin.fileno()
+        with selectors.DefaultSelector() as sel:
+            sel.register(fd, selectors.EVENT_READ)
+            sel.register(self._wake_r, selectors.EVENT_READ)
+            while b"\n" not in self._stdin_buf:
+                ready = [key.fileobj for key, _ in sel.select()]
+                if self._wake_r in ready:
+                    self._drain_wake()
+                    print()
+                    return None
+                data = os.read(fd, 4096)
+                if not data:
+                    if not self._stdin_buf:
+                        raise EOFError
+                    break
+                self._stdin_buf += data
+        line, _, self._stdin_buf = self._stdin_buf.partition(b"\n")
+        return line.decode(sys.stdin.encoding or "utf-8", errors="replace").rstrip("\r")
+
+    def _drain_wake(self):
+        # several events can land before we wake up; swallow them all so the next prompt doesn't return at once
+        try:
+            while os.read(self._wake_r, 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self._wake_r is not None:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = None
+
     def clear_history(self):
-        self.chat_history = []
+        self.chat_history.clear()
 
     def get_active_service_info(self) -> Optional[tuple[str, str]]:
         if self._active_service_name:
@@ -237,9 +445,13 @@ class ZeroconfAIClient:
         return None
     
 
-def check_health(url: str, timeout: float = 2.0) -> bool:
+def check_health(url: str, timeout=_HEALTH_TIMEOUT) -> bool:
     try:
-        response = requests.get(f"{url}/v1/health", timeout=timeout)
+        method = _HEALTH_METHOD.get(url, "HEAD")
+        response = _SESSION.request(method, f"{url}/v1/health", timeout=timeout, allow_redirects=False)
+        if response.status_code == 405 and method == "HEAD":
+            _HEALTH_METHOD[url] = "GET"
+            response = _SESSION.get(f"{url}/v1/health", timeout=timeout, allow_redirects=False)
         return response.status_code == 200
     except:
         return False
@@ -248,21 +460,26 @@ def main():
     timeout = 10.0 
     print("Searching for AI services on your network...")
 
-    service_manager = ServiceManager()
+    service_manager = get_service_manager()
 
-    start = time.time()
     print("Waiting for services...") 
-    while len(service_manager) == 0 and (time.time() - start) < timeout:
-        time.sleep(0.5)
+    service_manager.discovered.wait(timeout)
     
     if len(service_manager) == 0:
         raise Exception("No AI Services were found before timeout. Please try again or make sure services are running.")
     
     client = ZeroconfAIClient(service_manager)
+
+    # only re-snapshot the menu when a service actually came or went
+    services_changed = threading.Event()
+    service_manager.on_service_event(lambda event, name, url: services_changed.set())
+    services_list = None
     
     try:
         while True:
-            services_list = list(service_manager.items())
+            if services_list is None or services_changed.is_set():
+                services_changed.clear()
+                services_list = service_manager.snapshot_urls()
             for i, (name, url) in enumerate(services_list, 1):
                 print(f"{i}. {name} ({url})")
             
@@ -282,7 +499,7 @@ def main():
                     print(f"\nService {selected_name} is no longer available. Please select again.")
                     continue
 
-                if not check_health(selected_url, timeout=5.0):
+                if not service_manager.verify_health(selected_url, timeout=5.0):
                     print(f"\nService {selected_name} at {selected_url} is not healthy. Please select again.")
                     service_manager.remove_service_from_manager(selected_name)
                     continue
@@ -308,7 +525,10 @@ def main():
                         print(f"\nService went offline. Returning to service selection...")
                         break
 
-                    user_input = input("You: ").strip()
+                    user_input = client.prompt("You: ")
+                    if user_input is None:
+                        continue
+                    user_input = user_input.strip()
                     
                     if user_input.lower() in ['quit', 'exit']:
                         print("Goodbye!")
@@ -324,8 +544,10 @@ def main():
                         continue
                     
                     try:
-                        response = client.chat(user_input)
-                        print(f"Assistant: {response}\n")
+                        print("Assistant: ", end="", flush=True)
+                        for token in client.chat_stream(user_input):
+                            print(token, end="", flush=True)
+                        print("\n")
                         
                     except RuntimeError as e:
                         print(f"\nError: {e}")
@@ -353,6 +575,8 @@ def main():
         print("Closing connections and cleaning up...")
         service_manager.browser.cancel()
         service_manager.zc.close()
+        client.session.close()
+        client.close()
 
 
 if __name__ == "__main__":
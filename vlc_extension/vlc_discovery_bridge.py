@@ -1,3 +1,4 @@
+import asyncio
 import socket
 import subprocess
 import threading
@@ -6,15 +7,18 @@ import argparse
 import os
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Dict, List, Optional
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import iterate_in_threadpool
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import json
 
@@ -25,6 +29,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How many services a chat request may be tried against before giving up
+MAX_ROUTE_ATTEMPTS = 2
+# Upper bound on concurrent health probes per monitor round
+HEALTH_CHECK_WORKERS = 16
+# (connect, read) - a host that isn't listening should fail fast, a busy one still gets time to answer
+HEALTH_TIMEOUT = (0.5, 2)
+MODELS_TIMEOUT = (0.5, 3)
+
 @dataclass
 class AIService:
     name: str
@@ -51,7 +63,7 @@ class ServiceDiscovery:
     def __init__(self, discovery_interval: int = 10, on_service_change=None):
         self.services: Dict[str, AIService] = {}
         self.lock = threading.Lock()
-        self.running = True
+        self._stop = threading.Event()
         self.discovery_interval = discovery_interval
         self.on_service_change = on_service_change
         self.thread = threading.Thread(target=self._discovery_loop, daemon=True)
@@ -59,12 +71,13 @@ class ServiceDiscovery:
 
     def _discovery_loop(self):
         """Continuously discover services in background"""
-        while self.running:
+        while not self._stop.is_set():
             try:
                 self._discover_services()
             except Exception as e:
                 logger.debug(f"Discovery error: {e}")
-            time.sleep(self.discovery_interval)
+            # wakes immediately on stop() instead of sleeping out the interval
+            self._stop.wait(self.discovery_interval)
 
     def _discover_services(self):
         """Single discovery pass using DNS-SD subprocess"""
@@ -245,47 +258,60 @@ class ServiceDiscovery:
 
     def stop(self):
         """Stop background discovery"""
-        self.running = False
+        self._stop.set()
 
 class HealthMonitor:
     """Continuously monitor health of discovered services"""
     def __init__(self, discovery: ServiceDiscovery, check_interval: int = 10):
         self.discovery = discovery
         self.check_interval = check_interval
-        self.running = True
+        self._stop = threading.Event()
+        # probe services concurrently so one slow host doesn't stretch the whole round
+        self._pool = ThreadPoolExecutor(max_workers=HEALTH_CHECK_WORKERS, thread_name_prefix="hc")
+        # one keep-alive connection per service shared by the probe workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HEALTH_CHECK_WORKERS, pool_maxsize=HEALTH_CHECK_WORKERS)
+        self.session.mount("http://", adapter)
         self.thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self.thread.start()
 
     def _monitor_loop(self):
-        while self.running:
+        while not self._stop.is_set():
             services = self.discovery.get_all_services()
 
-            for service in services:
-                was_healthy = service.is_healthy
-                service.is_healthy = self._check_health(service.url)
-                service.last_seen = datetime.now()
+            # drain the iterator so the round finishes before we sleep
+            for _ in self._pool.map(self._probe, services):
+                pass
+
+            self._stop.wait(self.check_interval)
+
+        self._pool.shutdown(wait=False)
+        self.session.close()
 
-                if service.is_healthy:
-                    service.available_models = self._fetch_models(service.url)
+    def _probe(self, service: AIService):
+        was_healthy = service.is_healthy
+        service.is_healthy = self._check_health(service.url)
+        service.last_seen = datetime.now()
 
-                if service.first_check_complete and service.is_healthy != was_healthy:
-                    status = "healthy" if service.is_healthy else "unhealthy"
-                    logger.info(f"{service.name} is now {status}")
+        if service.is_healthy:
+            service.available_models = self._fetch_models(service.url)
 
-                service.first_check_complete = True
+        if service.first_check_complete and service.is_healthy != was_healthy:
+            status = "healthy" if service.is_healthy else "unhealthy"
+            logger.info(f"{service.name} is now {status}")
 
-            time.sleep(self.check_interval)
+        service.first_check_complete = True
 
     def _check_health(self, url: str) -> bool:
         try:
-            response = requests.get(f"{url}/v1/health", timeout=2)
+            response = self.session.get(f"{url}/v1/health", timeout=HEALTH_TIMEOUT)
             return response.status_code == 200
         except Exception:
             return False
 
     def _fetch_models(self, url: str) -> List[str]:
         try:
-            response = requests.get(f"{url}/v1/models", timeout=3)
+            response = self.session.get(f"{url}/v1/models", timeout=MODELS_TIMEOUT)
             if response.status_code == 200:
                 data = response.json()
                 return [model["id"] for model in data.get("models", [])]
@@ -294,7 +320,7 @@ class HealthMonitor:
         return []
 
     def stop(self):
-        self.running = False
+        self._stop.set()
 
 class BridgeManager:
     """Manages service discovery and health monitoring"""
@@ -306,12 +332,14 @@ class BridgeManager:
         services = self.discovery.get_all_services()
         return [s for s in services if s.is_healthy]
 
-    def get_best_service(self) -> Optional[AIService]:
+    def get_best_service(self, services: Optional[List[AIService]] = None) -> Optional[AIService]:
         """Get best service by priority (lowest number = highest priority)"""
-        services = self.get_healthy_services()
+        if services is None:
+            services = self.get_healthy_services()
         if not services:
             return None
-        return min(services, key=lambda s: s.priority)
+        # get_healthy_services keeps discovery's priority order, so the head is the best
+        return services[0]
 
     def get_service_by_name(self, name: str) -> Optional[AIService]:
         service = self.discovery.get_service(name)
@@ -378,10 +406,11 @@ async def get_services():
         raise HTTPException(status_code=503, detail="Discovery not initialized")
 
     services = bridge_manager.get_healthy_services()
+    best = bridge_manager.get_best_service(services)
     return {
         "count": len(services),
         "services": [s.to_dict() for s in services],
-        "best": bridge_manager.get_best_service().to_dict() if bridge_manager.get_best_service() else None
+        "best": best.to_dict() if best else None
     }
 
 @app.get("/v1/health")
@@ -457,8 +486,6 @@ async def chat_completions_core(request: ChatRequest, raw_request: Request):
     if not bridge_manager:
         raise HTTPException(status_code=503, detail="Discovery not initialized")
 
-    service = None
-
     # User can explicitly request a specific service, otherwise we pick the best one by priority
     if request.service:
         service = bridge_manager.get_service_by_name(request.service)
@@ -467,65 +494,87 @@ async def chat_completions_core(request: ChatRequest, raw_request: Request):
                 status_code=404,
                 detail=f"Requested service '{request.service}' not found or unhealthy"
             )
+        candidates = [service]
     else:
-        service = bridge_manager.get_best_service()
-        if not service:
+        candidates = bridge_manager.get_healthy_services()
+        if not candidates:
             raise HTTPException(status_code=503, detail="No AI services available")
+        # The best service is always tried first; alternates must actually serve the requested model
+        if request.model:
+            candidates = candidates[:1] + [s for s in candidates[1:] if request.model in s.available_models]
+        candidates = candidates[:MAX_ROUTE_ATTEMPTS]
 
-    model = request.model
-    if not model and service.available_models:
-        model = service.available_models[0]
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    last_status, last_detail = 503, "No models available on selected service"
 
-    if not model:
-        raise HTTPException(status_code=503, detail="No models available on selected service")
+    for service in candidates:
+        model = request.model
+        if not model and service.available_models:
+            model = service.available_models[0]
 
-    payload = {
-        "model": model,
-        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-        "stream": request.stream
-    }
+        if not model:
+            last_status, last_detail = 503, "No models available on selected service"
+            continue
 
-    if request.max_tokens is not None:
-        payload["max_tokens"] = request.max_tokens
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": request.stream
+        }
 
-    logger.info(f"Routing chat to {service.name} ({service.url}) using model {model}")
+        if request.max_tokens is not None:
+            payload["max_tokens"] = request.max_tokens
 
-    try:
-        # Forward the request to the selected Saturn service
-        response = requests.post(
-            f"{service.url}/v1/chat/completions",
-            json=payload,
-            timeout=60,
-            stream=request.stream
-        )
-
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=f"AI service error: {response.text}")
-
-        if request.stream:
-            async def generate():
-                try:
-                    for chunk in response.iter_content(chunk_size=None):
-                        if await raw_request.is_disconnected():
-                            break
-                        if chunk:
-                            yield chunk
-                finally:
-                    response.close()
-
-            return StreamingResponse(
-                generate(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "X-Accel-Buffering": "no"
-                }
+        logger.info(f"Routing chat to {service.name} ({service.url}) using model {model}")
+
+        try:
+            # Forward the request to the selected Saturn service, on a worker thread so a slow
+            # upstream doesn't freeze /health, /services etc. while we wait
+            response = await asyncio.to_thread(
+                requests.post,
+                f"{service.url}/v1/chat/completions",
+                json=payload,
+                timeout=60,
+                stream=request.stream
             )
-        else:
-            return response.json()
 
-    except requests.RequestException as e:
-        raise HTTPException(status_code=502, detail=f"Failed to connect to AI service: {str(e)}")
+            # Server-side failures fall through to the next candidate, client errors are final
+            if response.status_code >= 500:
+                last_status, last_detail = response.status_code, f"AI service error: {response.text}"
+                response.close()
+                logger.warning(f"{service.name} returned {response.status_code}, trying next service")
+                continue
+
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code, detail=f"AI service error: {response.text}")
+
+            if request.stream:
+                async def generate():
+                    try:
+                        async for chunk in iterate_in_threadpool(response.iter_content(chunk_size=None)):
+                            if await raw_request.is_disconnected():
+                                break
+                            if chunk:
+                                yield chunk
+                    finally:
+                        response.close()
+
+                return StreamingResponse(
+                    generate(),
+                    media_type="text/event-stream",
+                    headers={
+                        "Cache-Control": "no-cache",
+                        "X-Accel-Buffering": "no"
+                    }
+                )
+            else:
+                return response.json()
+
+        except requests.RequestException as e:
+            last_status, last_detail = 502, f"Failed to connect to AI service: {str(e)}"
+            logger.warning(f"{service.name} failed: {e}")
+
+    raise HTTPException(status_code=last_status, detail=last_detail)
 
 def find_port_number(host: str, start_port: int = 9876, max_attempts: int = 20) -> int:
     """Find an available port automatically"""
@@ -544,12 +593,12 @@ def find_port_number(host: str, start_port: int = 9876, max_attempts: int = 20)
 def wait_for_server_ready(host: str, port: int, timeout: int = 15) -> bool:
     """Poll the server until it's ready to accept connections"""
     url = f"http://{host}:{port}/v1/health"
-    start_time = time.time()
+    start_time = time.monotonic()
     attempt = 0
 
     logger.info(f"Waiting for server to be ready at {url}...")
 
-    while time.time() - start_time < timeout:
+    while time.monotonic() - start_time < timeout:
         attempt += 1
         try:
             response = requests.get(url, timeout=1)